@@ -1,16 +1,28 @@
+import functools
+import gc
 import importlib
+import threading
 
 import flask
+import jinja2
 from werkzeug.datastructures import ImmutableDict
 
+import keg.assets
 import keg.cli
 import keg.config
 from keg.ctx import KegRequestContext
 import keg.logging
+import keg.profiling
 import keg.signals as signals
 from keg.extensions import lazy_gettext as _
 from keg.templating import _keg_default_template_ctx_processor, AssetsExtension
-from keg.utils import classproperty, visit_modules, hybridmethod
+from keg.utils import (
+    classproperty,
+    dependency_order,
+    hybridmethod,
+    prefetch_modules,
+    visit_modules,
+)
 import keg.web
 
 
@@ -18,6 +30,50 @@ class KegAppError(Exception):
     pass
 
 
+class _LazyWebObject(object):
+    """
+        Stands in for an object that needs the app's routes and blueprints, e.g. its URL map, until
+        it's used.  `resolve` is called once, on first use, and returns the real object.
+    """
+    __slots__ = ('_resolve', '_resolved')
+
+    def __init__(self, resolve):
+        self._resolve = resolve
+        self._resolved = None
+
+    def _get(self):
+        if self._resolved is None:
+            self._resolved = self._resolve()
+        return self._resolved
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __setitem__(self, key, value):
+        self._get()[key] = value
+
+    def __delitem__(self, key):
+        del self._get()[key]
+
+    def __contains__(self, key):
+        return key in self._get()
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+    def __bool__(self):
+        return bool(self._get())
+
+    def __repr__(self):
+        return repr(self._get())
+
+
 class Keg(flask.Flask):
     import_name = None
     use_blueprints = ()
@@ -31,6 +87,11 @@ class Keg(flask.Flask):
     db_visit_modules = ['.model.entities']
     db_manager = None
 
+    # shared by the AssetManager of each request, see init_assets()
+    asset_cache = None
+    # templates resolved by BaseView, keyed by (view class, blueprint), see init_jinja()
+    view_template_cache = None
+
     jinja_options = ImmutableDict(
         extensions=[AssetsExtension]
     )
@@ -40,8 +101,30 @@ class Keg(flask.Flask):
 
     visit_modules = False
 
+    # Load config from a snapshot of a previous init when no config file, config module or
+    # app environment variable has changed.  See Config.snapshot_key().
+    config_snapshot_enabled = False
+
     _init_ran = False
 
+    # set by init(), see keg.profiling
+    startup_profile = None
+
+    # Apps created by the CLI loader are initialized with lazy_web=True when set.  See init().
+    cli_lazy_web = False
+
+    # List and complete CLI commands from a manifest saved by a previous invocation, without
+    # loading the app.  See keg.cli.CommandManifest.
+    cli_manifest_enabled = False
+
+    # Web init steps postponed until ensure_web().  None when nothing is pending.
+    _web_deferred = None
+    _web_initializing = False
+    # the exception raised by a deferred web init step, see ensure_web()
+    _web_error = None
+    # Flask attributes that stand in for the real ones until ensure_web(), see init_lazy_web().
+    lazy_web_attributes = ('url_map', 'blueprints', 'view_functions')
+
     def __init__(self, import_name=None, *args, **kwargs):
 
         # flask requires an import name, so we should too.
@@ -66,27 +149,187 @@ class Keg(flask.Flask):
             root_path = self.instance_path
         return self.config_class(root_path, self.default_config)
 
-    def init(self, config_profile=None, use_test_profile=False, config=None):
+    def init(self, config_profile=None, use_test_profile=False, config=None, lazy_web=False):
+        """
+            `lazy_web`: postpone registering routes, blueprints and the blueprints of components,
+            and the view module imports that come with them, until ensure_web() is called.  That
+            happens the first time the app's URL map, blueprints or view functions are used.
+        """
         if self._init_ran:
             raise KegAppError(_('init() already called on this instance'))
         self._init_ran = True
 
-        self.init_config(config_profile, use_test_profile, config)
-        self.init_logging()
-        self.init_error_handling()
-        self.init_extensions()
-        self.init_routes()
-        self.init_blueprints()
-        self.init_jinja()
-        self.init_visit_modules()
-
-        self.on_init_complete()
-        signals.app_ready.send(self)
-        signals.init_complete.send(self)
-
+        if lazy_web:
+            self.init_lazy_web()
+
+        self.startup_profile = keg.profiling.StartupProfile()
+        with self.startup_profile.activate() as profile:
+            profile.run('init_config', self.init_config, config_profile, use_test_profile, config)
+            profile.run('init_logging', self.init_logging)
+            profile.run('init_error_handling', self.init_error_handling)
+            profile.run('init_extensions', self.init_extensions)
+            profile.run('init_routes', self.init_routes)
+            profile.run('init_blueprints', self.init_blueprints)
+            profile.run('init_jinja', self.init_jinja)
+            profile.run('init_assets', self.init_assets)
+            profile.run('init_visit_modules', self.init_visit_modules)
+
+            profile.run('on_init_complete', self.on_init_complete)
+            profile.run('app_ready', keg.profiling.send, signals.app_ready, self)
+            profile.run('init_complete', keg.profiling.send, signals.init_complete, self)
+
+            # Not frozen at config_complete, components and init_complete receivers may still
+            # need to set config values.
+            if self.config.get('KEG_CONFIG_FREEZE'):
+                self.config.freeze()
+
+            if self.config.get('KEG_WARMUP_ENABLED'):
+                profile.run('warm_up', self.warm_up)
+
+        if self.config.get('KEG_STARTUP_PROFILE_LOG'):
+            self.logger.info(
+                _('App initialized in {ms:.1f}ms', ms=self.startup_profile.total * 1000),
+                extra={'startup_profile': self.startup_profile.as_dict()},
+            )
         # return self for easy chaining, i.e. app = MyKegApp().init()
         return self
 
+    def init_lazy_web(self):
+        """
+            Replace the attributes that need routes and blueprints with stand-ins that call
+            ensure_web() when used.  Plain instance attributes are restored by ensure_web(), so apps
+            pay nothing for lazy web init once it's done, or when it's not used.
+        """
+        self._web_deferred = []
+        self._web_lock = threading.RLock()
+        self._web_attributes = {name: getattr(self, name) for name in self.lazy_web_attributes}
+        self._set_lazy_web_objects()
+
+    def _set_lazy_web_objects(self):
+        for name in self.lazy_web_attributes:
+            setattr(self, name, _LazyWebObject(functools.partial(self._ensure_web_get, name)))
+        self.create_url_adapter = self._lazy_create_url_adapter
+
+    def _ensure_web_get(self, name):
+        self.ensure_web()
+        return getattr(self, name)
+
+    def _lazy_create_url_adapter(self, request):
+        # An app context pushed outside of a request, e.g. by a CLI command, binds the URL map
+        # when SERVER_NAME is set.  Wait until the adapter is used to register the routes.
+        if request is None and self.config['SERVER_NAME'] is not None:
+            return _LazyWebObject(self._ensure_web_url_adapter)
+        self.ensure_web()
+        return self.create_url_adapter(request)
+
+    def _ensure_web_url_adapter(self):
+        self.ensure_web()
+        return self.create_url_adapter(None)
+
+    def defer_web_init(self, func, *args, **kwargs):
+        """ Call func now or, if the app was initialized with lazy_web, in ensure_web(). """
+        if self._web_deferred is None or self._web_initializing:
+            return func(*args, **kwargs)
+        self._web_deferred.append((func, args, kwargs))
+
+    def ensure_web(self):
+        """ Run the web init steps postponed by lazy_web.  Safe to call more than once. """
+        if self._web_deferred is None:
+            return
+        with self._web_lock:
+            # Already done by another thread, or the deferred steps are using the URL map, etc.
+            if self._web_deferred is None or self._web_initializing:
+                return
+            if self._web_error is not None:
+                raise KegAppError(_('The web init of this app failed, see the cause above.')) \
+                    from self._web_error
+            self._web_initializing = True
+            try:
+                # the deferred steps, and everything after them, use the real objects
+                for name, value in self._web_attributes.items():
+                    if isinstance(self.__dict__.get(name), _LazyWebObject):
+                        setattr(self, name, value)
+                self.__dict__.pop('create_url_adapter', None)
+                with self.startup_profile.phase('ensure_web'):
+                    for func, args, kwargs in self._web_deferred:
+                        func(*args, **kwargs)
+                self._web_deferred = None
+            except Exception as exc:
+                # The steps that ran can't run again, and requests served from a partial URL map
+                # would get 404s.  Put the stand-ins back so every later use fails.
+                self._web_error = exc
+                self._set_lazy_web_objects()
+                raise
+            finally:
+                self._web_initializing = False
+
+    def add_url_rule(self, *args, **kwargs):
+        return self.defer_web_init(super().add_url_rule, *args, **kwargs)
+
+    def register_blueprint(self, *args, **kwargs):
+        return self.defer_web_init(super().register_blueprint, *args, **kwargs)
+
+    def warm_up(self):
+        """
+            Do the work otherwise done on first use, then move every object allocated so far out of
+            the garbage collector's generations.  Once forked, workers don't write to the memory
+            pages of those objects when the garbage collector runs, so they stay shared.
+
+            Compiles the templates found by the Jinja loader, those with one of the
+            ``KEG_WARMUP_TEMPLATE_EXTENSIONS``, and the dispatch plans of views.
+        """
+        self.ensure_web()
+
+        # template folders also hold assets, e.g. .js and .css files, which aren't rendered
+        extensions = self.config.get('KEG_WARMUP_TEMPLATE_EXTENSIONS')
+        for template_name in self.jinja_env.list_templates(extensions=extensions):
+            try:
+                self.jinja_env.get_template(template_name)
+            except jinja2.TemplateError as exc:
+                # Reported when the template is rendered, the same as without the warm up.
+                self.logger.debug(_('Warm up skipped template {name}: {error}',
+                                    name=template_name, error=str(exc)))
+
+        for view_func in self.view_functions.values():
+            view_class = getattr(view_func, 'view_class', None)
+            if isinstance(view_class, type) and issubclass(view_class, keg.web.BaseView):
+                view_class.dispatch_plan()
+
+        gc.collect()
+        gc.freeze()
+
+    @classmethod
+    def preload(cls, **init_kwargs):
+        """
+            Create and init an app meant to be shared by the worker processes of a pre-fork server,
+            e.g. gunicorn with ``preload_app``.  Routes and blueprints are registered and the config
+            is frozen before the workers are forked, so they share that memory.  Each worker should
+            call ``app.post_fork()`` once it starts.
+        """
+        app = cls().init(**init_kwargs)
+        app.ensure_web()
+        if not app.config.frozen:
+            app.config.freeze()
+        return app
+
+    def post_fork(self):
+        """
+            Reset the per-process state inherited from the parent process.  Call in each worker
+            forked from a preloaded app.  Apps with state of their own to reset can connect to the
+            ``post_fork`` signal or override ``on_post_fork()``.
+        """
+        if self.db_manager is not None:
+            self.db_manager.dispose_engines()
+        self.logging.reopen_syslog()
+        # The threads of the loader pool are not copied into the forked process.
+        keg.web.shutdown_loader_executor()
+        self.on_post_fork()
+        signals.post_fork.send(self)
+
+    def on_post_fork(self):
+        """ For subclasses to override """
+        pass
+
     def on_init_complete(self):
         """ For subclasses to override """
         pass
@@ -95,12 +338,14 @@ class Keg(flask.Flask):
         init_config = self._init_config.copy()
         init_config.update(config or {})
 
-        self.config.init_app(config_profile, self.import_name, self.root_path, use_test_profile)
+        self.config.init_app(config_profile, self.import_name, self.root_path, use_test_profile,
+                             snapshot=self.config_snapshot_enabled,
+                             app_instance_path=self.instance_path)
 
         self.config.update(init_config)
 
-        signals.config_ready.send(self)
-        signals.config_complete.send(self)
+        keg.profiling.send(signals.config_ready, self)
+        keg.profiling.send(signals.config_complete, self)
         self.on_config_complete()
 
     def on_config_complete(self):
@@ -130,10 +375,47 @@ class Keg(flask.Flask):
         # for import. At the top level of the imported path, there should be a `__component__`
         # that takes the dotted path that was used for import (as an absolute parent for relative
         # imports) and has an init_app. Ideally, based on KegComponent.
+        components = {}
         for comp_path in self.config.get('KEG_REGISTERED_COMPONENTS', set()):
-            comp_module = importlib.import_module(comp_path)
-            comp_object = getattr(comp_module, '__component__')
-            comp_object.init_app(self, parent_path=comp_path)
+            with keg.profiling.timed_import(comp_path):
+                comp_module = importlib.import_module(comp_path)
+            components[comp_path] = getattr(comp_module, '__component__')
+
+        comp_paths = self.component_order(components)
+
+        prefetch_workers = self.config.get('KEG_COMPONENT_PREFETCH_WORKERS')
+        if prefetch_workers:
+            # With lazy_web, views are imported when the blueprints are registered.
+            blueprints = self._web_deferred is None
+            prefetch_modules(
+                [module_path for comp_path in comp_paths for module_path in
+                 components[comp_path].module_paths(comp_path, blueprints=blueprints)],
+                prefetch_workers,
+            )
+
+        for comp_path in comp_paths:
+            components[comp_path].init_app(self, parent_path=comp_path)
+
+    def component_order(self, components):
+        """
+            The dotted paths of `components`, which maps dotted paths to component objects, in the
+            order the components should be initialized.  That's the order they were registered in,
+            except that a component is moved after the components it `requires`.
+        """
+        dependencies = {}
+        for comp_path, component in components.items():
+            requires = getattr(component, 'requires', ())
+            missing = set(requires).difference(components)
+            if missing:
+                raise KegAppError(_('Component {comp_path} requires unregistered components:'
+                                    ' {missing}', comp_path=comp_path,
+                                    missing=', '.join(sorted(missing))))
+            dependencies[comp_path] = requires
+
+        try:
+            return dependency_order(dependencies)
+        except ValueError as exc:
+            raise KegAppError(str(exc)) from exc
 
     def init_blueprints(self):
         for blueprint in self.use_blueprints:
@@ -154,6 +436,7 @@ class Keg(flask.Flask):
 
     def init_jinja(self):
         self.jinja_env.filters.update(self.template_filters)
+        self.view_template_cache = {}
 
         # template_context_processors is supposed to be functions that return dictionaries where
         # the key is the name of the template variable and the value is the value.
@@ -161,6 +444,16 @@ class Keg(flask.Flask):
         self.template_context_processors[None].append(_keg_default_template_ctx_processor)
         self.template_context_processors[None].append(lambda: self.template_globals)
 
+    def init_assets(self):
+        self.asset_cache = keg.assets.AssetCache(self.jinja_env)
+        if not self.config.get('KEG_ASSETS_BUNDLE_ENABLED'):
+            return
+
+        # bundles are built with `develop assets build`
+        self.asset_cache.load_manifest(keg.assets.bundle_dir(self))
+        self.add_url_rule(self.config['KEG_ASSETS_BUNDLE_URL_PATH'] + '/<path:filename>',
+                          'keg_assets_bundle', keg.assets.bundle_view)
+
     def init_visit_modules(self):
         if self.visit_modules:
             visit_modules(self.visit_modules, self.import_name)
@@ -244,6 +537,8 @@ class Keg(flask.Flask):
         if not hasattr(self, '_routes'):
             return
         for func, rule, options in self._routes:
-            # We follow the same logic here as Flask.route() decorator.
+            # We follow the same logic here as Flask.route() decorator.  The options are shared by
+            # every instance of the app class, so don't change them.
+            options = dict(options)
             endpoint = options.pop('endpoint', None)
             self.add_url_rule(rule, endpoint, func, **options)
@@ -1,15 +1,104 @@
 from collections import defaultdict
+import hashlib
+import json
+import os
 import pathlib
 
-from jinja2 import TemplateNotFound
+import flask
+from jinja2 import nodes, TemplateNotFound, TemplateSyntaxError
+from markupsafe import Markup
 
 from keg.extensions import lazy_gettext as _
+from keg.utils import ensure_dirs, write_atomic
+
+MANIFEST_FNAME = 'manifest.json'
 
 
 class AssetException(Exception):
     pass
 
 
+class AssetCache(object):
+    """
+        An app-level cache of asset files, shared by the per-request AssetManager instances.
+
+        Assets are cached by name along with whether they were found at all, so templates using
+        `{% assets_include %}` don't hit the template loader on every request.  When the Jinja
+        environment auto-reloads templates, found assets are checked with the loader's uptodate
+        callable (file mtime for the file system loader) and missing assets are looked for again.
+
+        The combined output of each ordered set of assets is cached as well.
+    """
+    # combined output is cached per distinct set of assets; start over if that grows unexpectedly
+    max_combined = 1000
+
+    def __init__(self, env):
+        self.env = env
+        # asset name -> (filename, contents, uptodate), or None when the asset was not found
+        self.assets = {}
+        # tuple of (asset_name, filename, contents) -> combined output
+        self.combined = {}
+        # asset name -> bundle file name, see load_manifest()
+        self.bundles = {}
+
+    def get(self, asset_name):
+        """ Returns a (filename, contents) tuple for the asset or None if it doesn't exist. """
+        try:
+            entry = self.assets[asset_name]
+        except KeyError:
+            pass
+        else:
+            if not self.env.auto_reload or self.is_up_to_date(entry):
+                return entry[:2] if entry is not None else None
+
+        try:
+            contents, filename, uptodate = self.env.loader.get_source(self.env, asset_name)
+            entry = (filename, contents, uptodate)
+        except TemplateNotFound:
+            entry = None
+        self.assets[asset_name] = entry
+        return entry[:2] if entry is not None else None
+
+    def is_up_to_date(self, entry):
+        if entry is None:
+            # a missing asset may have been added since
+            return False
+        uptodate = entry[2]
+        return uptodate is None or uptodate()
+
+    def load_manifest(self, dpath):
+        """
+            Load the manifest written by `develop assets build` so assets can be referenced by
+            their hashed bundle files.  A missing manifest is not an error, assets are then inlined
+            until bundles are built.
+        """
+        try:
+            with open(os.path.join(dpath, MANIFEST_FNAME)) as fo:
+                self.bundles = json.load(fo)
+        except FileNotFoundError:
+            self.bundles = {}
+        return self.bundles
+
+    def combine(self, content):
+        """ Combine (asset_name, filename, contents) tuples into a single string. """
+        key = tuple(content)
+        try:
+            return self.combined[key]
+        except KeyError:
+            pass
+
+        output = []
+        for asset_name, filename, contents in content:
+            comment = '/********************* asset: {} *********************/'.format(asset_name)
+            output.append(comment)
+            output.append(contents)
+
+        if len(self.combined) >= self.max_combined:
+            self.combined.clear()
+        self.combined[key] = retval = '\n\n'.join(output)
+        return retval
+
+
 class AssetManager(object):
     """
         A per-request helper object for managing assets related to a request/response cycle.
@@ -18,16 +107,18 @@ class AssetManager(object):
     def __init__(self, app):
         self.app = app
         self.env = self.app.jinja_env
+        # Keg apps share one cache across requests, see Keg.init_assets()
+        self.cache = getattr(app, 'asset_cache', None) or AssetCache(self.env)
         self.content = defaultdict(list)
 
     def load_asset(self, asset_name):
         asset_type = pathlib.Path(asset_name).suffix.lstrip('.')
-        try:
-            contents, filename, _ = self.env.loader.get_source(self.env, asset_name)
-            self.content[asset_type].append((asset_name, filename, contents))
-            return True
-        except TemplateNotFound:
+        found = self.cache.get(asset_name)
+        if found is None:
             return False
+        filename, contents = found
+        self.content[asset_type].append((asset_name, filename, contents))
+        return True
 
     def load_related(self, template_name):
         js_asset_name = str(pathlib.PurePosixPath(template_name).with_suffix('.js'))
@@ -39,9 +130,113 @@ class AssetManager(object):
                                    template_name=template_name))
 
     def combine_content(self, asset_type):
+        return self.cache.combine(self.content[asset_type])
+
+    def tags(self, asset_type):
+        """
+            Like combine_content() but returns the HTML tags for the assets.  Assets with a built
+            bundle are referenced by URL so browsers can cache them, any others are inlined.
+        """
+        if asset_type not in BUNDLE_TAGS:
+            raise AssetException(_('Unsupported asset type: {asset_type}', asset_type=asset_type))
+        src_tag, inline_tag = BUNDLE_TAGS[asset_type]
+
         output = []
-        for asset_name, filename, contents in self.content[asset_type]:
-            comment = '/********************* asset: {} *********************/'.format(asset_name)
-            output.append(comment)
-            output.append(contents)
-        return '\n\n'.join(output)
+        inline = []
+        for entry in self.content[asset_type]:
+            bundle = self.cache.bundles.get(entry[0])
+            if bundle is None:
+                inline.append(entry)
+                continue
+            if inline:
+                output.append(inline_tag.format(self.cache.combine(inline)))
+                inline = []
+            output.append(src_tag.format(flask.url_for('keg_assets_bundle', filename=bundle)))
+        if inline:
+            output.append(inline_tag.format(self.cache.combine(inline)))
+        return Markup('\n'.join(output))
+
+
+# asset type -> (tag referencing a bundle, tag with inline content)
+BUNDLE_TAGS = {
+    'js': ('<script src="{}"></script>', '<script>\n{}\n</script>'),
+    'css': ('<link rel="stylesheet" href="{}">', '<style>\n{}\n</style>'),
+}
+
+
+def bundle_dir(app):
+    return app.config.get('KEG_ASSETS_BUNDLE_DIR') or os.path.join(app.instance_path, 'assets')
+
+
+def bundle_view(filename):
+    """ Serves the bundles written by AssetBundler, they are content-hashed so cache for long. """
+    app = flask.current_app
+    response = flask.send_from_directory(bundle_dir(app), filename)
+    # Set here instead of with send_from_directory(max_age=...), which is cache_timeout in Flask 1.
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['KEG_ASSETS_BUNDLE_MAX_AGE']
+    return response
+
+
+class AssetBundler(object):
+    """
+        Writes content-hashed bundle files for the assets related to each template that uses
+        `{% assets_include %}`, along with a manifest mapping asset names to the bundle files.
+        The manifest is used by AssetCache.load_manifest() when bundles are enabled.
+    """
+    hash_length = 12
+
+    def __init__(self, app, output_dir):
+        self.app = app
+        self.env = app.jinja_env
+        self.output_dir = output_dir
+        # (template name, exception) for templates that could not be parsed
+        self.errors = []
+
+    def including_templates(self):
+        """ Names of the templates that include their related assets """
+        for template_name in self.env.list_templates():
+            if pathlib.PurePosixPath(template_name).suffix in ('.js', '.css'):
+                continue
+            source, filename, _uptodate = self.env.loader.get_source(self.env, template_name)
+            if 'assets_include' not in source:
+                continue
+            try:
+                ast = self.env.parse(source, template_name, filename)
+            except TemplateSyntaxError as e:
+                self.errors.append((template_name, e))
+                continue
+            calls = ast.find_all(nodes.ExtensionAttribute)
+            if any(node.name == '_include_support' for node in calls):
+                yield template_name
+
+    def bundle_name(self, asset_name, contents):
+        digest = hashlib.sha256(contents.encode('utf-8')).hexdigest()[:self.hash_length]
+        asset_path = pathlib.PurePosixPath(asset_name)
+        bundle_fname = '{}.{}{}'.format(asset_path.stem, digest, asset_path.suffix)
+        return str(asset_path.with_name(bundle_fname))
+
+    def build(self):
+        manifest = {}
+        for template_name in self.including_templates():
+            template_path = pathlib.PurePosixPath(template_name)
+            for suffix in ('.js', '.css'):
+                asset_name = str(template_path.with_suffix(suffix))
+                try:
+                    contents = self.env.loader.get_source(self.env, asset_name)[0]
+                except TemplateNotFound:
+                    continue
+                bundle = self.bundle_name(asset_name, contents)
+                self.write(bundle, contents)
+                manifest[asset_name] = bundle
+
+        self.write(MANIFEST_FNAME, json.dumps(manifest, indent=2, sort_keys=True))
+        return manifest
+
+    def write(self, fname, contents):
+        fpath = os.path.join(self.output_dir, fname)
+        dpath = os.path.dirname(fpath)
+        ensure_dirs(dpath, mode=self.app.config['KEG_DIR_MODE'])
+        # a running app must never see a partial file, and a front-end web server may serve them
+        write_atomic(fpath, contents, mode=0o644)
@@ -1,14 +1,31 @@
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from itertools import chain
+import functools
+import itertools
+import json
+import os
+import os.path as osp
+import re
+import shlex
+import sys
+import time
+import traceback
 import urllib
+import uuid
 
 import click
 import flask
 import flask.cli
+import jinja2
+import werkzeug.exceptions
+import werkzeug.routing
 
 from keg import current_app
+import keg.assets
+import keg.plugins
+import keg.profiling
 from keg.extensions import gettext as _
+from keg.utils import write_atomic
 
 
 try:
@@ -23,10 +40,215 @@ except ImportError:
         return False
 
 
+class LazyPluginCommand(click.Command):
+    """
+        Stands in for a command from an entry point.  Its name, short help and hidden flag come from
+        the entry point index, the plugin's module is only imported to run the command, complete
+        its arguments or show its own help.
+    """
+    def __init__(self, name, entry, index):
+        click.Command.__init__(self, name, short_help=entry['short_help'],
+                               hidden=entry['hidden'])
+        self.entry = entry
+        self.index = index
+        self._command = None
+
+    def load(self):
+        if self._command is None:
+            self._command = keg.plugins.load_entry_point(self.entry['value'])
+            self.index.record_command(self.name, self._command)
+        return self._command
+
+    def get_short_help_str(self, limit=45):
+        if self.short_help is None:
+            return self.load().get_short_help_str(limit)
+        return click.Command.get_short_help_str(self, limit)
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        return self.load().make_context(info_name, args, parent=parent, **extra)
+
+    def invoke(self, ctx):
+        return self.load().invoke(ctx)
+
+    def get_params(self, ctx):
+        return self.load().get_params(ctx)
+
+    def shell_complete(self, ctx, incomplete):
+        return self.load().shell_complete(ctx, incomplete)
+
+    def to_info_dict(self, ctx):
+        return self.load().to_info_dict(ctx)
+
+
+class CommandManifest(object):
+    """
+        The names, short help and subcommands of an app's commands, saved once the app has been
+        loaded so that later invocations can list and complete commands without loading it.  The
+        manifest is out of date when a module the app had imported from its root path, or the
+        installed distributions, have changed.
+    """
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.reset()
+
+    def reset(self):
+        # read the manifest again, it may have changed since the last invocation
+        self._commands = None
+        self.saved = False
+
+    def commands(self):
+        """ The manifest's tree of commands, or None if there is no up to date manifest. """
+        if self._commands is None:
+            self._commands = self.load() or False
+        return self._commands or None
+
+    def load(self):
+        try:
+            with open(self.fpath) as fo:
+                manifest = json.load(fo)
+            if manifest['distributions'] != keg.plugins.distributions_key():
+                return None
+            for fpath, mtime in manifest['files'].items():
+                if os.stat(fpath).st_mtime_ns != mtime:
+                    return None
+        except (OSError, ValueError, KeyError, TypeError):
+            # missing, unreadable, from an incompatible version or a module was removed
+            return None
+        return manifest['commands']
+
+    def save(self, group, ctx, app):
+        self.saved = True
+        files = {}
+        for module in list(sys.modules.values()):
+            fpath = getattr(module, '__file__', None)
+            if fpath and fpath.startswith(app.root_path + os.sep):
+                try:
+                    files[fpath] = os.stat(fpath).st_mtime_ns
+                except OSError:
+                    pass
+        commands = self.command_entries(click.Group.list_commands(group, ctx),
+                                        lambda name: click.Group.get_command(group, ctx, name),
+                                        ctx)
+        data = json.dumps(dict(distributions=keg.plugins.distributions_key(), files=files,
+                               commands=commands))
+        try:
+            os.makedirs(osp.dirname(self.fpath), exist_ok=True)
+            write_atomic(self.fpath, data.encode('utf-8'))
+        except OSError:
+            return False
+        self._commands = commands
+        return True
+
+    def command_entries(self, names, get_command, ctx):
+        entries = {}
+        for name in names:
+            command = get_command(name)
+            if command is None:
+                continue
+            if isinstance(command, LazyPluginCommand):
+                command = command.load()
+            entries[name] = entry = dict(
+                # may be a lazy string
+                help=None if command.help is None else str(command.help),
+                short_help=command.get_short_help_str(limit=sys.maxsize),
+                hidden=command.hidden,
+                has_params=bool(command.params),
+                invoke_without_command=getattr(command, 'invoke_without_command', False),
+                commands=None,
+            )
+            if hasattr(command, 'list_commands'):
+                entry['commands'] = self.command_entries(
+                    command.list_commands(ctx),
+                    lambda name, command=command: command.get_command(ctx, name),
+                    ctx,
+                )
+        return entries
+
+
+class ManifestCommand(click.Command):
+    """
+        Stands in for a command listed in the app's CommandManifest.  The app is only loaded, and
+        the real command used, to run the command, complete its arguments or show its own help.
+    """
+    def __init__(self, name, entry, path, root):
+        super().__init__(name, help=entry['help'], short_help=entry['short_help'],
+                         hidden=entry['hidden'])
+        self.entry = entry
+        # names of the parent groups and of this command, from the root group down
+        self.path = path
+        self.root = root
+
+    def load(self, ctx):
+        self.root._load_app(ctx)
+        command = self.root
+        for name in self.path:
+            command = command.get_command(ctx, name)
+        return command
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        return self.load(parent).make_context(info_name, args, parent=parent, **extra)
+
+    def invoke(self, ctx):
+        return self.load(ctx).invoke(ctx)
+
+    def get_params(self, ctx):
+        return self.load(ctx).get_params(ctx)
+
+    def shell_complete(self, ctx, incomplete):
+        return self.load(ctx).shell_complete(ctx, incomplete)
+
+    def to_info_dict(self, ctx):
+        return self.load(ctx).to_info_dict(ctx)
+
+
+class ManifestGroup(ManifestCommand, click.Group):
+    """ A ManifestCommand for a group.  Its subcommands are listed from the manifest. """
+    def __init__(self, name, entry, path, root):
+        super().__init__(name, entry, path, root)
+        self.invoke_without_command = entry['invoke_without_command']
+        self.no_args_is_help = not self.invoke_without_command
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        if self.entry['has_params']:
+            return ManifestCommand.make_context(self, info_name, args, parent=parent, **extra)
+        # Nothing to parse but the subcommand, which can be completed from the manifest.  The
+        # group's callback is called by invoke().
+        return click.Group.make_context(self, info_name, args, parent=parent, **extra)
+
+    def get_params(self, ctx):
+        if self.entry['has_params']:
+            return ManifestCommand.get_params(self, ctx)
+        return click.Group.get_params(self, ctx)
+
+    def shell_complete(self, ctx, incomplete):
+        if self.entry['has_params']:
+            return ManifestCommand.shell_complete(self, ctx, incomplete)
+        return click.Group.shell_complete(self, ctx, incomplete)
+
+    def list_commands(self, ctx):
+        return sorted(self.entry['commands'])
+
+    def get_command(self, ctx, name):
+        if name not in self.entry['commands']:
+            return self.load(ctx).get_command(ctx, name)
+        return manifest_command(name, self.entry['commands'][name], self.path, self.root)
+
+
+def manifest_command(name, entry, parent_path, root):
+    cls = ManifestCommand if entry['commands'] is None else ManifestGroup
+    return cls(name, entry, parent_path + (name, ), root)
+
+
 class KegAppGroup(flask.cli.AppGroup):
-    def __init__(self, create_app, add_default_commands=True, load_dotenv=True, *args, **kwargs):
+    # Cache the entry point index of plugin commands on disk, see keg.plugins
+    plugin_index_cached = True
+
+    def __init__(self, create_app, add_default_commands=True, load_dotenv=True, *args,
+                 manifest=None, **kwargs):
         self.create_app = create_app
         self.load_dotenv = load_dotenv
+        # see CLILoader.create_group()
+        self.manifest = manifest
 
         flask.cli.AppGroup.__init__(self, *args, **kwargs)
         if add_default_commands:
@@ -37,45 +259,48 @@ class KegAppGroup(flask.cli.AppGroup):
     def _load_plugin_commands(self):
         if self._loaded_plugin_commands:
             return
-        entry_point_iterables = []
-
-        # older Flask
-        try:
-            import pkg_resources
-            entry_point_iterables.extend([
-                pkg_resources.iter_entry_points('flask.commands'),
-                pkg_resources.iter_entry_points('keg.commands'),
-            ])
-        except ImportError:
-            return
 
-        # newer Flask
-        try:
-            # uses importlib, but python has some API variations. Let flask handle that.
-            from flask.cli import metadata
-            entry_point_iterables.extend([
-                metadata.entry_points(group="flask.commands"),
-                metadata.entry_points(group="keg.commands"),
-            ])
-        except ImportError:
-            pass
-
-        for ep in chain.from_iterable(entry_point_iterables):
-            self.add_command(ep.load(), ep.name)
+        # Plugin modules are only imported when their command is used, see LazyPluginCommand.
+        index = self.plugin_index()
+        for name, entry in index.load().items():
+            self.add_command(LazyPluginCommand(name, entry, index))
         self._loaded_plugin_commands = True
 
+    def plugin_index(self):
+        return keg.plugins.EntryPointIndex(
+            cache_dpath=keg.plugins.default_cache_dpath() if self.plugin_index_cached else None,
+        )
+
     def _load_app(self, ctx):
         self._load_plugin_commands()
 
         info = ctx.ensure_object(flask.cli.ScriptInfo)
-        info.load_app()
+        app = info.load_app()
+
+        if self.manifest is not None and not self.manifest.saved \
+                and self.manifest.commands() is None:
+            self.manifest.save(self, ctx, app)
+
+    def manifest_commands(self, ctx):
+        """ The command tree of the manifest, if it is up to date and the app isn't loaded yet. """
+        if self.manifest is None or ctx.ensure_object(flask.cli.ScriptInfo)._loaded_app:
+            return None
+        return self.manifest.commands()
 
     def list_commands(self, ctx):
+        commands = self.manifest_commands(ctx)
+        if commands is not None:
+            return sorted(commands)
+
         self._load_app(ctx)
         rv = set(click.Group.list_commands(self, ctx))
         return sorted(rv)
 
     def get_command(self, ctx, name):
+        commands = self.manifest_commands(ctx)
+        if commands is not None and name in commands:
+            return manifest_command(name, commands[name], (), self)
+
         self._load_app(ctx)
         return click.Group.get_command(self, ctx, name)
 
@@ -85,13 +310,63 @@ class KegAppGroup(flask.cli.AppGroup):
 
         obj = kwargs.get('obj')
         if obj is None:
-            obj = flask.cli.ScriptInfo(create_app=self.create_app)
+            # see CLILoader.init_kwargs() for the debug flag
+            obj = flask.cli.ScriptInfo(create_app=self.create_app, set_debug_flag=False)
         kwargs['obj'] = obj
+        if self.manifest is not None:
+            self.manifest.reset()
         # TODO: figure out if we want to use this next line.
         #kwargs.setdefault('auto_envvar_prefix', 'FLASK')
         return flask.cli.AppGroup.main(self, *args, **kwargs)
 
 
+def with_web(func):
+    """
+        Make sure the app's routes and blueprints are registered before the command runs, for apps
+        that use a lazy web init in the CLI (see Keg.cli_lazy_web).  Use it below
+        ``flask.cli.with_appcontext``.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        flask.current_app.ensure_web()
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def run_command_line(group, args, **kwargs):
+    """
+        Run a command line through group like a CLI invocation would, but return its exit code
+        instead of exiting.  Unexpected exceptions are printed to stderr, with exit code 1.
+    """
+    try:
+        group.main(args=args, **kwargs)
+    except SystemExit as exc:
+        exit_code = exc.code
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+    else:
+        exit_code = 0
+
+    if exit_code is None:
+        return 0
+    if not isinstance(exit_code, int):
+        click.echo(exit_code, err=True)
+        return 1
+    return exit_code
+
+
+def parse_command_lines(lines):
+    """ (line number, argv) of each command in lines, skipping blank lines and # comments. """
+    for lineno, line in enumerate(lines, start=1):
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as exc:
+            raise click.UsageError(_('Line {lineno}: {error}', lineno=lineno, error=str(exc)))
+        if argv:
+            yield lineno, argv
+
+
 @click.group('develop', help=_('Developer info and utils.'))
 def dev_command():
     pass
@@ -101,44 +376,371 @@ dev_command.add_command(flask.cli.run_command)
 dev_command.add_command(flask.cli.shell_command)
 
 
-@dev_command.command('routes', short_help=_('List the routes defined for this app.'))
+format_option = click.option(
+    '--format', 'output_format', type=click.Choice(['text', 'json']), default='text',
+    show_default=True, help=_('Output format.'),
+)
+
+
+def route_rows(url_map):
+    """ Endpoint, methods and rule of each route, sorted by endpoint. """
+    rows = [
+        dict(
+            endpoint=rule.endpoint,
+            methods=sorted(rule.methods or ()),
+            rule=urllib.parse.unquote(rule.rule),
+        )
+        for rule in url_map.iter_rules()
+    ]
+    rows.sort(key=lambda row: (row['endpoint'], row['methods'], row['rule']))
+    return rows
+
+
+# values to build sample paths with, for werkzeug's converters
+sample_converter_values = (
+    (werkzeug.routing.IntegerConverter, 1),
+    (werkzeug.routing.FloatConverter, 1.0),
+    (werkzeug.routing.UUIDConverter, uuid.UUID(int=1)),
+)
+
+
+def sample_value(converter):
+    if isinstance(converter, werkzeug.routing.AnyConverter):
+        if not converter.items:
+            raise ValueError(_('any() converter has no values'))
+        return sorted(converter.items)[0]
+    for converter_cls, value in sample_converter_values:
+        if isinstance(converter, converter_cls):
+            if getattr(converter, 'min', None) is not None:
+                return max(value, converter.min)
+            return value
+    return 'sample'
+
+
+# a <converter(arguments):name> part of a rule string
+rule_variable_re = re.compile(r'''
+    <
+    (?:
+        (?P<converter>[a-zA-Z_][a-zA-Z0-9_]*)
+        (?:\((?P<arguments>.*?)\))?
+        :
+    )?
+    (?P<name>[a-zA-Z_][a-zA-Z0-9_]*)
+    >
+''', re.VERBOSE)
+
+
+def rule_converters(rule, url_map):
+    """ The converter of each of the rule's arguments, as the url map creates them. """
+    converters = {}
+    for match in rule_variable_re.finditer(rule.rule):
+        args, kwargs = (), {}
+        if match.group('arguments'):
+            args, kwargs = werkzeug.routing.parse_converter_args(match.group('arguments'))
+        converter_cls = url_map.converters[match.group('converter') or 'default']
+        converters[match.group('name')] = converter_cls(url_map, *args, **kwargs)
+    return converters
+
+
+def route_samples(url_map):
+    """
+        (method, path, endpoint) of a request for each route that can be matched without a host,
+        and (rule, endpoint, reason) of the routes skipped: those with a host or subdomain, or
+        whose converters don't accept the sample values.
+    """
+    samples = []
+    skipped = []
+    for rule in url_map.iter_rules():
+        if rule.host or rule.subdomain:
+            skipped.append((rule.rule, rule.endpoint, _('host or subdomain')))
+            continue
+        try:
+            values = {name: sample_value(converter)
+                      for name, converter in rule_converters(rule, url_map).items()}
+            built = rule.build(values, append_unknown=False)
+        except Exception as exc:
+            skipped.append((rule.rule, rule.endpoint, str(exc) or type(exc).__name__))
+            continue
+        if built is None:
+            skipped.append((rule.rule, rule.endpoint, _('no path built from sample values')))
+            continue
+        methods = rule.methods or ('GET', )
+        method = 'GET' if 'GET' in methods else sorted(methods)[0]
+        samples.append((method, built[1], rule.endpoint))
+    return samples, skipped
+
+
+def time_match(adapter, method, path, repeat):
+    """ What path matches, the endpoint or the exception raised, and the mean time to match it. """
+    def match():
+        try:
+            return adapter.match(path, method=method)[0]
+        except (werkzeug.exceptions.HTTPException, werkzeug.routing.RoutingException) as exc:
+            return type(exc).__name__
+
+    matched = match()
+    start = time.perf_counter()
+    for _repeat in range(repeat):
+        match()
+    return matched, (time.perf_counter() - start) / repeat
+
+
+@dev_command.group('routes', invoke_without_command=True,
+                   short_help=_('List the routes defined for this app.'))
+@format_option
+@click.pass_context
+def routes_group(ctx, output_format):
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(routes_command, output_format=output_format)
+
+
 @flask.cli.with_appcontext
-def routes_command():
-    output = []
-    endpoint_len = 0
-    methods_len = 0
-
-    # calculate how wide the output columns need to be
-    for rule in flask.current_app.url_map.iter_rules():
-        methods = ','.join(rule.methods)
-        endpoint_len = max(endpoint_len, len(rule.endpoint))
-        methods_len = max(methods_len, len(methods))
-
-    # generate the output
-    for rule in flask.current_app.url_map.iter_rules():
-        methods = ','.join(rule.methods)
-        line = urllib.parse.unquote("{}   {}   {}".format(
-            rule.endpoint.ljust(endpoint_len), methods.ljust(methods_len), rule))
-        output.append(line)
-
-    for line in sorted(output):
+@with_web
+def routes_command(output_format):
+    rows = route_rows(flask.current_app.url_map)
+    if output_format == 'json':
+        click.echo(json.dumps(rows, indent=2))
+        return
+
+    methods = [','.join(row['methods']) for row in rows]
+    endpoint_len = max((len(row['endpoint']) for row in rows), default=0)
+    methods_len = max((len(row_methods) for row_methods in methods), default=0)
+    for row, row_methods in zip(rows, methods):
+        click.echo('{}   {}   {}'.format(
+            row['endpoint'].ljust(endpoint_len), row_methods.ljust(methods_len), row['rule']))
+
+
+@routes_group.command('bench', short_help=_('Time URL matching against the routes.'))
+@click.argument('paths', nargs=-1)
+@click.option('--method', default='GET', show_default=True,
+              help=_('Request method for the PATHS given.'))
+@click.option('--repeat', default=100, show_default=True, type=click.IntRange(min=1),
+              help=_('Times each path is matched.'))
+@click.option('--limit', default=20, show_default=True, type=click.IntRange(min=0),
+              help=_('Show this many of the slowest paths, 0 for all.'))
+@format_option
+@flask.cli.with_appcontext
+@with_web
+def routes_bench_command(paths, method, repeat, limit, output_format):
+    """
+        Time how long the app's URL map takes to match PATHS, or a sample path built for each
+        route.  Sample paths that match another route than the one they were built for point to
+        rule ordering problems.
+    """
+    app = flask.current_app
+    skipped = []
+    if paths:
+        samples = [(method.upper(), path, None) for path in paths]
+    else:
+        samples, skipped = route_samples(app.url_map)
+
+    adapter = app.url_map.bind(app.config.get('SERVER_NAME') or 'localhost')
+    results = []
+    for sample_method, path, endpoint in samples:
+        matched, seconds = time_match(adapter, sample_method, path, repeat)
+        results.append(dict(method=sample_method, path=path, endpoint=endpoint, matched=matched,
+                            microseconds=round(seconds * 1e6, 2)))
+    results.sort(key=lambda result: result['microseconds'], reverse=True)
+    mismatched = [result for result in results
+                  if result['endpoint'] is not None and result['matched'] != result['endpoint']]
+
+    if output_format == 'json':
+        skipped = [dict(rule=rule, endpoint=endpoint, reason=reason)
+                   for rule, endpoint, reason in skipped]
+        click.echo(json.dumps(dict(results=results, skipped=skipped), indent=2))
+        return
+
+    for result in results[:limit or None]:
+        line = '{:>10.2f}us   {} {} -> {}'.format(
+            result['microseconds'], result['method'], result['path'], result['matched'])
+        if result in mismatched:
+            line += _(' (built for {endpoint})', endpoint=result['endpoint'])
         click.echo(line)
+    for rule, endpoint, reason in skipped:
+        click.echo(_('Skipped {rule} ({endpoint}): {reason}', rule=rule, endpoint=endpoint,
+                     reason=reason))
+    click.echo(_('Matched {count} paths in {total:.2f}ms, {mismatched} matched another route,'
+                 ' {skipped} routes skipped.', count=len(results),
+                 total=sum(result['microseconds'] for result in results) / 1000,
+                 mismatched=len(mismatched), skipped=len(skipped)))
+
+
+def template_sources(app):
+    """
+        (name, search path, templates) of the app's and its blueprints' template folders, in the
+        order Flask searches them.  Other kinds of loaders have no search path.
+    """
+    scaffolds = [('app', app)] + [(bp.name, bp) for bp in app.iter_blueprints()]
+    for name, scaffold in scaffolds:
+        loader = scaffold.jinja_loader
+        if loader is None:
+            continue
+        if not isinstance(loader, jinja2.FileSystemLoader):
+            yield name, None, sorted(loader.list_templates())
+            continue
+        for dpath in loader.searchpath:
+            yield name, dpath, sorted(jinja2.FileSystemLoader(dpath).list_templates())
 
 
 @dev_command.command('templates', short_help=_('Show paths searched for a template.'))
+@format_option
 @flask.cli.with_appcontext
-def templates_command():
-    jinja_loader = flask.current_app.jinja_env.loader
-    paths = defaultdict(list)
-    for template in jinja_loader.list_templates():
-        for loader, template in jinja_loader._iter_loaders(template):
-            for dpath in loader.searchpath:
-                paths[dpath].append(template)
-    for dpath in sorted(paths.keys()):
-        template_paths = sorted(paths[dpath])
-        click.echo(dpath)
-        for tpath in template_paths:
-            click.echo('    {}'.format(tpath))
+@with_web
+def templates_command(output_format):
+    sources = []
+    found = set()
+    for name, dpath, templates in template_sources(flask.current_app):
+        # a template in a folder searched earlier is the one that gets rendered
+        shadowed = sorted(found.intersection(templates))
+        found.update(templates)
+        sources.append(dict(source=name, search_path=dpath, templates=templates,
+                            shadowed=shadowed))
+
+    if output_format == 'json':
+        click.echo(json.dumps(sources, indent=2))
+        return
+
+    for source in sources:
+        click.echo(source['search_path'] or source['source'])
+        shadowed = set(source['shadowed'])
+        for template in source['templates']:
+            if template in shadowed:
+                click.echo('    {} {}'.format(template, _('(shadowed)')))
+            else:
+                click.echo('    {}'.format(template))
+
+
+@dev_command.command('startup-profile', short_help=_('Show where app initialization time'
+                     ' was spent.'))
+@flask.cli.with_appcontext
+def startup_profile_command():
+    profile = flask.current_app.startup_profile
+    for line in profile.report():
+        click.echo(line)
+
+
+@dev_command.command('memory-report', short_help=_('Show shared and private memory of'
+                     ' processes.'))
+@click.argument('pids', nargs=-1, type=int)
+@click.option('--children', is_flag=True, default=False,
+              help=_('Report on the child processes of the given PIDs, e.g. server workers.'))
+def memory_report_command(pids, children):
+    pids = pids or (os.getpid(),)
+    if children:
+        pids = [child for pid in pids for child in keg.profiling.child_pids(pid)]
+
+    columns = ('Rss', 'Pss', 'Shared', 'Private')
+    click.echo(('{:>8}' + '{:>12}' * len(columns)).format('PID', *columns))
+    for pid in pids:
+        usage = keg.profiling.memory_usage(pid)
+        click.echo(('{:>8}' + '{:>9} kB' * len(columns)).format(
+            pid, *(usage[column] for column in columns)
+        ))
+
+
+@dev_command.command('serve-cli', short_help=_('Run commands sent by keg/cli_client.py with a warm'
+                     ' app.'))
+@click.option('--socket', 'socket_path', default=None,
+              help=_("Unix socket to listen on.  Defaults to cli.sock in the app's user cache"
+                     " directory."))
+@flask.cli.with_appcontext
+def serve_cli_command(socket_path):
+    from keg.cli_server import CLIServer
+
+    app = flask.current_app._get_current_object()
+    loader = app.cli_loader_class(type(app))
+    if socket_path is None:
+        socket_path = osp.join(keg.plugins.user_cache_dpath(app.import_name), 'cli.sock')
+        os.makedirs(osp.dirname(socket_path), exist_ok=True)
+
+    server = CLIServer(socket_path, loader)
+    # commands given the same app options as this one use this app
+    server.add_app(click.get_current_context().find_object(flask.cli.ScriptInfo).data, app)
+    server.serve()
+
+
+@dev_command.command('batch', short_help=_('Run the commands listed in a file with one app.'))
+@click.argument('commands_file', type=click.File('r'), default='-')
+@click.option('--workers', default=1, show_default=True, type=click.IntRange(min=1),
+              help=_('Run this many commands at a time.  Only for commands that are independent'
+                     ' of each other.'))
+@flask.cli.with_appcontext
+def batch_command(commands_file, workers):
+    """
+        Run the commands in COMMANDS_FILE, or stdin, one per line, without the app's name, e.g.
+        ``db init``.  Arguments are split like a shell would.
+
+        The app is initialized once, each command runs in its own app context.  A failing command
+        doesn't stop the others, the ones that failed are listed at the end.
+    """
+    app = flask.current_app._get_current_object()
+    root_ctx = click.get_current_context().find_root()
+    commands = list(parse_command_lines(commands_file))
+
+    # options that configure the app, like --quiet, can't change the app already initialized
+    app_options = {
+        opt
+        for param in root_ctx.command.params
+        if isinstance(param, click.Option) and param.expose_value
+        for opt in param.opts
+    }
+    for lineno, argv in commands:
+        for arg in itertools.takewhile(lambda arg: arg.startswith('-'), argv):
+            option = arg.split('=', 1)[0]
+            if option in app_options:
+                raise click.UsageError(_(
+                    'Line {lineno}: {option} applies to the whole batch, give it before'
+                    ' "develop batch"', lineno=lineno, option=option,
+                ))
+
+    def run(argv):
+        # a ScriptInfo per command: app level options like --quiet would change its data
+        script_info = flask.cli.ScriptInfo(create_app=lambda: app, set_debug_flag=False)
+        with app.app_context():
+            return run_command_line(root_ctx.command, argv, prog_name=root_ctx.info_name,
+                                    obj=script_info)
+
+    if workers == 1:
+        exit_codes = [run(argv) for _lineno, argv in commands]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='keg-batch') as pool:
+            exit_codes = list(pool.map(run, [argv for _lineno, argv in commands]))
+
+    failed = [
+        (lineno, argv, exit_code)
+        for (lineno, argv), exit_code in zip(commands, exit_codes) if exit_code != 0
+    ]
+    for lineno, argv, exit_code in failed:
+        click.echo(_('Line {lineno} exited with {exit_code}: {command}', lineno=lineno,
+                     exit_code=exit_code, command=' '.join(map(shlex.quote, argv))), err=True)
+    click.echo(_('{count} commands ran, {failed} failed.', count=len(commands),
+                 failed=len(failed)), err=True)
+    if failed:
+        sys.exit(1)
+
+
+@dev_command.group('assets', help=_('Asset bundling utils.'))
+def assets_group():
+    pass
+
+
+@assets_group.command('build', short_help=_('Write hashed bundles of the assets related to'
+                      ' templates.'))
+@click.option('--output-dir', default=None,
+              help=_('Directory to write bundles to.  Defaults to KEG_ASSETS_BUNDLE_DIR.'))
+@flask.cli.with_appcontext
+@with_web
+def assets_build_command(output_dir):
+    app = flask.current_app
+    bundler = keg.assets.AssetBundler(app, output_dir or keg.assets.bundle_dir(app))
+    manifest = bundler.build()
+
+    for template_name, exc in bundler.errors:
+        click.echo(_('Skipped {template_name}: {error}', template_name=template_name,
+                     error=str(exc)))
+    for asset_name in sorted(manifest):
+        click.echo('{} -> {}'.format(asset_name, manifest[asset_name]))
+    click.echo(_('Bundles written to: {dpath}', dpath=bundler.output_dir))
 
 
 @dev_command.command('config', short_help=_('List info related to config files, profiles, and'
@@ -163,10 +765,17 @@ def config_command():
         for path, exc in config.config_paths_unreadable:
             click.echo('    {}: {}'.format(path, str(exc)))
 
+    if config.snapshot_loaded:
+        click.echo(_('Config loaded from a snapshot, config files were not executed.'))
+
     click.echo(_('Config objects used:'))
     for val in config.configs_found:
         click.echo('    {}'.format(val))
 
+    click.echo(_('Config timings:'))
+    for label, seconds in config.timings:
+        click.echo('    {}: {:.1f}ms'.format(label, seconds * 1000))
+
     click.echo(_('Resulting app config (including Flask defaults):'))
     for key in keys:
         click.echo('    {} = {}'.format(key, config[key]))
@@ -266,13 +875,23 @@ class CLILoader(object):
             The return value of this context gets set on Keg.cli
         """
 
+        manifest = None
+        if self.appcls.cli_manifest_enabled:
+            manifest = CommandManifest(self.manifest_fpath())
+
         return KegAppGroup(
             self.create_app,
             params=self.create_script_options(),
             callback=self.main_callback,
             invoke_without_command=True,
+            manifest=manifest,
         )
 
+    def manifest_fpath(self):
+        # the app's user cache dir, under XDG_CACHE_HOME when set
+        dpath = keg.plugins.user_cache_dpath(self.appcls.import_name)
+        return osp.join(dpath, 'cli-manifest.json')
+
     def create_app(self, script_info=False):
         """ Instantiate our app, sending CLI option values through as needed.
 
@@ -280,8 +899,17 @@ class CLILoader(object):
             So keep it as an arg, but don't use it to get the object.  See #163.
         """
         script_info = click.get_current_context().obj
-        init_kwargs = self.option_processor(script_info.data)
-        return self.appcls().init(**init_kwargs)
+        return self.appcls().init(**self.init_kwargs(script_info.data))
+
+    def init_kwargs(self, cli_options):
+        """ The kwargs create_app() gives to the app's .init() for the parsed app options. """
+        init_kwargs = self.option_processor(cli_options)
+        init_kwargs.setdefault('lazy_web', self.appcls.cli_lazy_web)
+        # Flask's ScriptInfo sets app.debug from FLASK_DEBUG once the app is created, when a frozen
+        # config can't change anymore.  Keg's ScriptInfo doesn't, DEBUG is given to init() instead.
+        config = init_kwargs['config'] = dict(init_kwargs.get('config') or {})
+        config.setdefault('DEBUG', flask.cli.get_debug_flag())
+        return init_kwargs
 
     def option_processor(self, cli_options):
         """
@@ -345,6 +973,9 @@ class CLILoader(object):
                 formatter.write_dl(opts)
 
     def format_commands(self, command, ctx, formatter):
+        if isinstance(command, LazyPluginCommand):
+            # plugin groups are listed with their subcommands
+            command = command.load()
         if hasattr(command, 'list_commands'):
             subcommands = command.list_commands(ctx)
 
@@ -0,0 +1,78 @@
+"""
+    Client for the ``develop serve-cli`` daemon, which runs an app's commands in a process where the
+    app is already initialized.
+
+    Only the standard library is used, so run this file as a script, not as ``python -m``, which
+    would import keg and the app's dependencies and lose most of the gain::
+
+        python path/to/keg/cli_client.py SOCKET [ARGS]...
+
+    Messages are JSON objects, one per line.  The client sends the command's argv, environment,
+    working directory and stdin.  The daemon replies with ``{"stream": ..., "data": ...}`` messages
+    for the command's output, then ``{"exit_code": ...}``.
+"""
+import json
+import os
+import socket
+import sys
+
+
+def write_message(fo, message):
+    fo.write(json.dumps(message).encode('utf-8') + b'\n')
+    fo.flush()
+
+
+def read_message(fo):
+    line = fo.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def run(socket_path, argv, env=None, cwd=None, stdin='', stdout=None, stderr=None):
+    """ Run a command through the daemon listening on socket_path, return its exit code. """
+    streams = dict(stdout=stdout or sys.stdout, stderr=stderr or sys.stderr)
+    request = dict(
+        argv=list(argv),
+        env=dict(os.environ if env is None else env),
+        cwd=cwd or os.getcwd(),
+        stdin=stdin,
+    )
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as fo:
+            write_message(fo, request)
+            while True:
+                message = read_message(fo)
+                if message is None:
+                    streams['stderr'].write('Connection to the CLI daemon was lost.\n')
+                    return 1
+                if 'exit_code' in message:
+                    return message['exit_code']
+                stream = streams[message['stream']]
+                stream.write(message['data'])
+                stream.flush()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        sys.stderr.write('Usage: cli_client.py SOCKET [ARGS]...\n')
+        sys.exit(2)
+
+    # Commands can't prompt through the daemon, only piped input is forwarded.
+    stdin = ''
+    if sys.stdin is not None and not sys.stdin.isatty():
+        stdin = sys.stdin.read()
+
+    try:
+        exit_code = run(argv[0], argv[1:], stdin=stdin)
+    except OSError as exc:
+        sys.stderr.write('Could not connect to the CLI daemon at {}: {}\n'.format(argv[0], exc))
+        exit_code = 1
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+    The ``develop serve-cli`` daemon.  It keeps initialized apps, one per combination of app level
+    CLI options and app environment variables, and runs the commands sent by ``keg/cli_client.py``
+    with them.
+"""
+import contextlib
+import io
+import json
+import os
+import socketserver
+import sys
+
+import click
+import flask.cli
+
+from keg.cli import run_command_line
+from keg.cli_client import read_message, write_message
+from keg.extensions import gettext as _
+
+
+class MessageWriter(io.TextIOBase):
+    """ A text stream that sends what is written to it to the client, as stream messages. """
+    encoding = 'utf-8'
+    errors = 'strict'
+
+    def __init__(self, fo, stream_name):
+        self.fo = fo
+        self.stream_name = stream_name
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        # click probes streams with write(b''), accepting bytes would make it wrap this one
+        if not isinstance(data, str):
+            raise TypeError('write() argument must be str, not {}'.format(type(data).__name__))
+        if data:
+            write_message(self.fo, dict(stream=self.stream_name, data=data))
+        return len(data)
+
+    def isatty(self):
+        return False
+
+
+@contextlib.contextmanager
+def process_state(env, cwd, stdin, stdout, stderr):
+    """ Use the client's environment, working directory and streams while running a command. """
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    saved_streams = sys.stdin, sys.stdout, sys.stderr
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(cwd)
+    sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+    try:
+        yield
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = saved_streams
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+
+class CLIRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = read_message(self.rfile)
+        if request is None:
+            return
+        exit_code = self.server.run_command(request, self.wfile)
+        write_message(self.wfile, dict(exit_code=exit_code))
+
+
+class CLIServer(socketserver.UnixStreamServer):
+    """
+        Runs one command at a time: the environment, working directory and standard streams
+        a command sees belong to the whole process.
+    """
+    def __init__(self, socket_path, loader, bind_and_activate=True):
+        self.loader = loader
+        # initialized apps keyed by their init() kwargs
+        self.apps = {}
+        # the app whose logging is set up between commands, see reset_logging()
+        self.logging_app = None
+        # the app used by the running command
+        self.command_app = None
+        socketserver.UnixStreamServer.__init__(self, socket_path, CLIRequestHandler,
+                                               bind_and_activate=bind_and_activate)
+
+    def server_bind(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.server_address)
+        # only the user running the daemon can connect
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.server_address)
+
+    def app_key(self, cli_options):
+        # The app's environment variables, e.g. MYAPP_CONFIG_PROFILE, select its config like the
+        # app level options do.  Called with the environment of the client's command.
+        environ_prefix = self.loader.appcls.environ_key('')
+        environ = sorted((key, value) for key, value in os.environ.items()
+                         if key.startswith(environ_prefix))
+        return json.dumps(dict(init_kwargs=self.loader.init_kwargs(cli_options), environ=environ),
+                          sort_keys=True, default=repr)
+
+    def add_app(self, cli_options, app):
+        self.apps[self.app_key(cli_options)] = app
+        if self.logging_app is None:
+            self.logging_app = app
+
+    def create_app(self):
+        """ Used by the ScriptInfo of each command, instead of CLILoader.create_app(). """
+        script_info = click.get_current_context().obj
+        key = self.app_key(script_info.data)
+        if key not in self.apps:
+            self.apps[key] = self.loader.create_app()
+        app = self.command_app = self.apps[key]
+        # Log handlers are global: they were set up by whichever app was initialized last, e.g.
+        # one without a stream handler because of --quiet, and for the streams of that command.
+        app.logging.clear_keg_handlers()
+        app.logging.init_app()
+        return app
+
+    def reset_logging(self):
+        """ Remove the handlers set up for the last command, which write to its client. """
+        app, self.command_app = self.command_app, None
+        if app is not None:
+            app.logging.clear_keg_handlers()
+        if self.logging_app is not None:
+            self.logging_app.logging.init_app()
+
+    def run_command(self, request, fo):
+        stdout = MessageWriter(fo, 'stdout')
+        stderr = MessageWriter(fo, 'stderr')
+        try:
+            with process_state(request['env'], request['cwd'],
+                               io.StringIO(request.get('stdin', '')), stdout, stderr):
+                return run_command_line(
+                    self.loader.appcls.cli,
+                    request['argv'],
+                    obj=flask.cli.ScriptInfo(create_app=self.create_app, set_debug_flag=False),
+                )
+        finally:
+            # once the daemon's own streams are back
+            self.reset_logging()
+
+    def serve(self):
+        click.echo(_('Serving CLI commands on {socket_path}', socket_path=self.server_address))
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
@@ -2,6 +2,8 @@ import importlib
 
 import flask
 
+from keg.profiling import timed_import
+
 
 class KegComponent:
     """ Keg components follow the paradigm of flask extensions, and provide some defaults for the
@@ -42,18 +44,23 @@ class KegComponent:
        pass absolute dotted paths and no alterations will be performed.
 
     template_folder: string to be passed for template config to blueprints created via the component
+
+    requires: an iterable of the dotted paths of other registered components which must be
+              initialized before this one. E.g. `('my_app.components.auth', )`
     """
     db_visit_modules = tuple()
     load_blueprints = tuple()
     template_folder = 'templates'
+    requires = tuple()
 
     def __init__(self, name, app=None, db_visit_modules=None, load_blueprints=None,
-                 template_folder=None, parent_path=None):
+                 template_folder=None, parent_path=None, requires=None):
         self.name = name
         # Allow customization of the defaults in the constructor
         self.db_visit_modules = db_visit_modules or self.db_visit_modules
         self.load_blueprints = load_blueprints or self.load_blueprints
         self.template_folder = template_folder or self.template_folder
+        self.requires = requires or self.requires
         if app:
             # Not really intended to be used this way, but it fits the flask extension paradigm
             # and could conceivably be set up in lieu of KEG_REGISTERED_COMPONENTS
@@ -66,19 +73,31 @@ class KegComponent:
         # paths is `.model.entities`, the full import is `my_app.components.widget.model.entities`
         self.init_config(app)
         self.init_db(parent_path)
-        self.init_blueprints(app, parent_path)
+        # Postponed when the app was initialized with lazy_web, see Keg.init()
+        app.defer_web_init(self.init_blueprints, app, parent_path)
 
     def init_config(self, app):
         # Components may define their own config defaults
         pass
 
+    def module_paths(self, parent_path, blueprints=True):
+        # Absolute dotted paths of the modules init_db() and, optionally, init_blueprints() import
+        dotted_paths = list(self.db_visit_modules)
+        if blueprints:
+            dotted_paths.extend(bp_path for bp_path, _ in self.load_blueprints)
+        return [
+            f'{parent_path}{dotted_path}' if dotted_path.startswith('.') else dotted_path
+            for dotted_path in dotted_paths
+        ]
+
     def init_db(self, parent_path):
         # Intent is to import the listed modules, so their entities are registered in metadata
         for dotted_path in self.db_visit_modules:
             import_name = dotted_path
             if import_name.startswith('.'):
                 import_name = f'{parent_path}{dotted_path}'
-            importlib.import_module(import_name)
+            with timed_import(import_name):
+                importlib.import_module(import_name)
 
     def init_blueprints(self, app, parent_path):
         # Register any blueprints that are listed by path in load_blueprints
@@ -86,7 +105,8 @@ class KegComponent:
             import_name = bp_path
             if import_name.startswith('.'):
                 import_name = f'{parent_path}{bp_path}'
-            mod_imported = importlib.import_module(import_name)
+            with timed_import(import_name):
+                mod_imported = importlib.import_module(import_name)
             app.register_blueprint(getattr(mod_imported, bp_attr))
 
     def create_blueprint(self, *args, **kwargs):
@@ -1,15 +1,26 @@
+from collections.abc import Mapping
+from contextlib import contextmanager
+import errno
+import hashlib
+import importlib.util
+import os
 import os.path as osp
+import pickle
+import sys
+import time
 
 import appdirs
 from blazeutils.helpers import tolist
 import flask
 from pathlib import PurePath
+from werkzeug.datastructures import ImmutableDict
 from werkzeug.utils import (
     import_string,
     ImportStringError
 )
 
-from keg.utils import app_environ_get, pymodule_fpaths_to_objects
+from keg.extensions import lazy_gettext as _
+from keg.utils import app_environ_get, ensure_dirs, pymodule_fpaths_to_objects, write_atomic
 
 
 class ConfigurationError(Exception):
@@ -24,7 +35,40 @@ class SubstituteValue(object):
 substitute = SubstituteValue
 
 
+class SubstitutionValues(Mapping):
+    """
+        The values available to SubstituteValue format strings.  Each source is a callable that is
+        only called if a format string uses its value.
+    """
+    def __init__(self, **sources):
+        self.sources = sources
+        self.computed = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.computed[key]
+        except KeyError:
+            pass
+        value = self.computed[key] = self.sources[key]()
+        return value
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __len__(self):
+        return len(self.sources)
+
+
+# Config file paths, and their directories, found not to exist.  Cached for the life of the process
+# so apps instantiated repeatedly don't keep looking for them.
+_missing_config_paths = set()
+
+
 class Config(flask.Config):
+    # see freeze()
+    frozen = False
+    app_instance_path = None
+
     default_config_locations = [
         # Keg's defaults
         'keg.config.DefaultProfile',
@@ -36,6 +80,89 @@ class Config(flask.Config):
         '{app_import_name}.config.{profile}',
     ]
 
+    def __init__(self, root_path, defaults=None):
+        super().__init__(root_path, defaults)
+        # keys holding a SubstituteValue, kept up to date as values are set so substitution_apply()
+        # doesn't need to look at every value
+        self.substitute_keys = {
+            key for key, value in self.items() if isinstance(value, SubstituteValue)
+        }
+
+    def freeze(self):
+        """
+            Make the config immutable, including any dict values.  Values computed by derived() are
+            cached from then on, since they can't go stale.
+        """
+        for key, value in self.items():
+            if isinstance(value, dict) and not isinstance(value, ImmutableDict):
+                dict.__setitem__(self, key, ImmutableDict(value))
+        self._derived = {}
+        self.frozen = True
+
+    def thaw(self):
+        """ Make a frozen config mutable again, e.g. to change values in tests. """
+        self.frozen = False
+        self._derived = {}
+
+    def derived(self, name, factory):
+        """
+            Returns ``factory(config)``, a value derived from config values.  When the config is
+            frozen, it's computed once and cached by name.
+        """
+        if not self.frozen:
+            return factory(self)
+        try:
+            return self._derived[name]
+        except KeyError:
+            value = self._derived[name] = factory(self)
+            return value
+
+    def check_not_frozen(self, key=None):
+        if self.frozen:
+            raise ConfigurationError(
+                _('Config is frozen, can not change {key}.', key=key) if key is not None
+                else _('Config is frozen, it can not be changed.')
+            )
+
+    def __setitem__(self, key, value):
+        self.check_not_frozen(key)
+        super().__setitem__(key, value)
+        if isinstance(value, SubstituteValue):
+            self.substitute_keys.add(key)
+        else:
+            self.substitute_keys.discard(key)
+
+    def __delitem__(self, key):
+        self.check_not_frozen(key)
+        super().__delitem__(key)
+        self.substitute_keys.discard(key)
+
+    def update(self, *args, **kwargs):
+        self.check_not_frozen()
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        self.check_not_frozen(key)
+        self.substitute_keys.discard(key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        self.check_not_frozen()
+        key, value = super().popitem()
+        self.substitute_keys.discard(key)
+        return key, value
+
+    def clear(self):
+        self.check_not_frozen()
+        super().clear()
+        self.substitute_keys.clear()
+
     def from_obj_if_exists(self, obj_location):
         try:
             self.from_object(obj_location)
@@ -56,45 +183,206 @@ class Config(flask.Config):
         return retval
 
     def init_app(self, app_config_profile, app_import_name, app_root_path, use_test_profile,
-                 config_file_objs=None):
+                 config_file_objs=None, snapshot=False, app_instance_path=None):
         self.use_test_profile = use_test_profile
+        self.app_instance_path = app_instance_path
         self.profile = app_config_profile
         self.dirs = appdirs.AppDirs(app_import_name, appauthor=False, multipath=True)
         self.app_import_name = app_import_name
         self.app_root_path = app_root_path
         self.config_paths_unreadable = []
+        self.snapshot_loaded = False
+        # (label, seconds) for each step, shown by `develop config`
+        self.timings = []
+
+        use_snapshot = snapshot and not config_file_objs
+        if use_snapshot:
+            # the path depends on the profile argument, so get it before the profile is selected
+            snapshot_fpath = self.snapshot_fpath()
+            with self.timed('snapshot load'):
+                snapshot_key = self.snapshot_key()
+                if self.snapshot_load(snapshot_fpath, snapshot_key):
+                    return
+            initial_values = dict(self)
 
         if config_file_objs:
             self.config_file_objs = config_file_objs
         else:
             self.config_file_objs = []
-            possible_config_fpaths = self.config_file_paths()
-            fpaths_to_objects = pymodule_fpaths_to_objects(possible_config_fpaths)
+            with self.timed('config file discovery'):
+                existing_fpaths, missing_fpaths = self.discover_config_files()
+            with self.timed('config files'):
+                fpaths_to_objects = pymodule_fpaths_to_objects(existing_fpaths)
             for fpath, objects, exc in fpaths_to_objects:
                 if objects is None:
                     self.config_paths_unreadable.append((fpath, exc))
                 else:
                     self.config_file_objs.append((fpath, objects))
+            self.config_paths_unreadable.extend(
+                (fpath, FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), fpath))
+                for fpath in missing_fpaths
+            )
 
         if self.profile is None:
             self.profile = self.determine_selected_profile()
 
         self.configs_found = []
 
-        for dotted_location in self.default_config_locations_parsed():
-            dotted_location = dotted_location.format(app_import_name=app_import_name,
-                                                     profile=self.profile)
-            self.from_obj_if_exists(dotted_location)
+        with self.timed('config objects'):
+            for dotted_location in self.default_config_locations_parsed():
+                dotted_location = dotted_location.format(app_import_name=app_import_name,
+                                                         profile=self.profile)
+                self.from_obj_if_exists(dotted_location)
 
-        # apply settings from any of this app's configuration files
-        for fpath, objects in self.config_file_objs:
-            if self.profile in objects:
-                self.from_object(objects[self.profile])
-                self.configs_found.append('{}:{}'.format(fpath, self.profile))
+            # apply settings from any of this app's configuration files
+            for fpath, objects in self.config_file_objs:
+                if self.profile in objects:
+                    self.from_object(objects[self.profile])
+                    self.configs_found.append('{}:{}'.format(fpath, self.profile))
 
         sub_values = self.substitution_values()
         self.substitution_apply(sub_values)
 
+        # snapshots aren't keyed on environment variables used by substitutions
+        if use_snapshot and 'env' not in getattr(sub_values, 'computed', ()):
+            with self.timed('snapshot save'):
+                self.snapshot_save(snapshot_fpath, snapshot_key, initial_values)
+
+    @contextmanager
+    def timed(self, label):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((label, time.perf_counter() - start))
+
+    def discover_config_files(self):
+        """
+            Split the distinct config file paths into those that exist and those that don't, in
+            priority order.  Each candidate directory is checked once, so the files of a missing
+            directory aren't looked for at all, and paths found missing are cached for the life of
+            the process.
+        """
+        fpaths = self.config_file_paths()
+        # a path may be listed twice, keep the last occurrence since later files have priority
+        fpaths = list(reversed(dict.fromkeys(reversed(fpaths))))
+
+        def missing(path):
+            if path in _missing_config_paths:
+                return True
+            try:
+                os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                _missing_config_paths.add(path)
+                return True
+            except OSError:
+                # e.g. permission denied, which is reported when the file is read
+                pass
+            return False
+
+        missing_dpaths = {}
+        existing_fpaths = []
+        missing_fpaths = []
+        for fpath in fpaths:
+            dpath = osp.dirname(fpath)
+            if dpath not in missing_dpaths:
+                missing_dpaths[dpath] = missing(dpath)
+            if missing_dpaths[dpath] or missing(fpath):
+                missing_fpaths.append(fpath)
+            else:
+                existing_fpaths.append(fpath)
+        return existing_fpaths, missing_fpaths
+
+    def snapshot_fpath(self):
+        """
+            Each combination of app location and profile arguments gets its own snapshot, so
+            processes using different profiles don't keep replacing each other's snapshot.
+        """
+        identity = repr((self.app_root_path, self.profile, self.use_test_profile))
+        digest = hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+        return osp.join(self.dirs.user_cache_dir, 'config-snapshot-{}.pickle'.format(digest))
+
+    def snapshot_key(self):
+        """
+            Everything that init_app() depends on, as far as we can tell without doing the work:
+            the stat of every config file and config module, and the app's environment variables.
+            Config files that depend on anything else (e.g. other environment variables) should not
+            be used with a snapshot.
+        """
+        def stat(fpath):
+            try:
+                st = os.stat(fpath)
+            except OSError:
+                return None
+            return st.st_mtime_ns, st.st_size
+
+        module_names = set()
+        for location in self.default_config_locations:
+            module_name = location.rsplit('.', 1)[0]
+            if '{profile}' not in module_name:
+                module_names.add(module_name.format(app_import_name=self.app_import_name))
+        module_stats = []
+        for module_name in sorted(module_names):
+            try:
+                spec = importlib.util.find_spec(module_name)
+            except ImportError:
+                spec = None
+            origin = spec.origin if spec is not None else None
+            module_stats.append((module_name, origin, stat(origin) if origin else None))
+
+        existing_fpaths, _missing_fpaths = self.discover_config_files()
+        environ_prefix = '{}_'.format(self.app_import_name.replace('.', '_').upper())
+        return (
+            sys.version_info[:2],
+            self.app_import_name,
+            self.app_instance_path,
+            [(fpath, stat(fpath)) for fpath in existing_fpaths],
+            module_stats,
+            sorted((key, value) for key, value in os.environ.items()
+                   if key.startswith(environ_prefix)),
+        )
+
+    def snapshot_load(self, fpath, snapshot_key):
+        try:
+            with open(fpath, 'rb') as fo:
+                snapshot = pickle.load(fo)
+        except Exception:
+            # missing, unreadable or from an incompatible version: just do the work
+            return False
+        if snapshot.get('key') != snapshot_key:
+            return False
+
+        self.update(snapshot['values'])
+        self.profile = snapshot['profile']
+        self.configs_found = snapshot['configs_found']
+        self.config_paths_unreadable = snapshot['config_paths_unreadable']
+        # the config file modules were not executed
+        self.config_file_objs = []
+        self.snapshot_loaded = True
+        return True
+
+    def snapshot_save(self, fpath, snapshot_key, initial_values):
+        snapshot = dict(
+            key=snapshot_key,
+            # only what init_app() set, Flask's defaults are already on a new config instance
+            values={key: value for key, value in self.items()
+                    if key not in initial_values or initial_values[key] is not value},
+            profile=self.profile,
+            configs_found=self.configs_found,
+            config_paths_unreadable=self.config_paths_unreadable,
+        )
+        dpath = osp.dirname(fpath)
+        try:
+            data = pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+            ensure_dirs(dpath, mode=self['KEG_DIR_MODE'])
+            # a concurrent process must never read a partial snapshot
+            write_atomic(fpath, data)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            # values that can't be pickled or a cache dir that can't be written just mean there
+            # is no snapshot for next time
+            return False
+        return True
+
     def config_file_paths(self):
         dirs = self.dirs
 
@@ -152,22 +440,30 @@ class Config(flask.Config):
         return profile
 
     def substitution_values(self):
-        return dict(
-            user_log_dir=self.dirs.user_log_dir,
-            app_import_name=self.app_import_name,
+        sources = dict(
+            app_import_name=lambda: self.app_import_name,
+            env=lambda: os.environ,
+            user_cache_dir=lambda: self.dirs.user_cache_dir,
+            user_data_dir=lambda: self.dirs.user_data_dir,
+            user_log_dir=lambda: self.dirs.user_log_dir,
         )
+        if self.app_instance_path is not None:
+            sources['instance_path'] = lambda: self.app_instance_path
+        return SubstitutionValues(**sources)
 
     def substitution_apply(self, sub_values):
-        for config_key, config_value in self.items():
-            if not isinstance(config_value, SubstituteValue):
-                continue
-            new_value = config_value.value.format(**sub_values)
-            self[config_key] = new_value
+        for config_key in sorted(self.substitute_keys):
+            self[config_key] = self[config_key].value.format_map(sub_values)
 
 
 # The following three classes are default configuration profiles
 class DefaultProfile(object):
+    KEG_COMPONENT_PREFETCH_WORKERS = 0
+    KEG_CONFIG_FREEZE = False
     KEG_DIR_MODE = 0o777
+    KEG_STARTUP_PROFILE_LOG = False
+    KEG_WARMUP_ENABLED = False
+    KEG_WARMUP_TEMPLATE_EXTENSIONS = ('htm', 'html', 'j2', 'jinja', 'jinja2', 'txt', 'xhtml', 'xml')
     KEG_ENDPOINTS = dict(
         home='public.home',
         login='public.home',
@@ -177,6 +473,12 @@ class DefaultProfile(object):
 
     KEG_DB_DIALECT_OPTIONS = {}
 
+    KEG_ASSETS_BUNDLE_ENABLED = False
+    KEG_ASSETS_BUNDLE_DIR = None
+    KEG_ASSETS_BUNDLE_URL_PATH = '/_assets'
+    # bundle file names include a hash of their contents, so they can be cached for a year
+    KEG_ASSETS_BUNDLE_MAX_AGE = 60 * 60 * 24 * 365
+
 
 class DevProfile(object):
     DEBUG = True
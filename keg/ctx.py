@@ -3,7 +3,12 @@ from keg.assets import AssetManager
 
 
 class KegRequestContext(RequestContext):
+    _assets = None
 
-    def __init__(self, app, environ, request=None):
-        super(KegRequestContext, self).__init__(app, environ, request)
-        self.assets = AssetManager(app)
+    @property
+    def assets(self):
+        """ The request's AssetManager, created the first time something needs it so that
+            requests which don't render assets don't pay for one. """
+        if self._assets is None:
+            self._assets = AssetManager(self.app)
+        return self._assets
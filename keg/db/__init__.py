@@ -2,6 +2,7 @@ import flask_sqlalchemy as fsa
 import sqlalchemy as sa
 import sqlalchemy.event as sa_event
 
+import keg.profiling
 from keg.signals import (
     db_before_import,
     db_clear_post,
@@ -105,7 +106,7 @@ class DatabaseManager(object):
 
     def init_app(self):
         db.init_app(self.app)
-        db_before_import.send(self.app)
+        keg.profiling.send(db_before_import, self.app)
         visit_modules(self.app.db_visit_modules, self.app.import_name)
 
     def init_events(self):
@@ -123,6 +124,14 @@ class DatabaseManager(object):
         for bind_name, engine in db.get_engines(self.app):
             yield DialectOperations.create_for(engine, bind_name, self.dialect_opts)
 
+    def dispose_engines(self):
+        """
+            Drop the connection pools inherited from a parent process, without closing their
+            connections, which the parent process may still be using.  For forked workers.
+        """
+        for bind_name, engine in db.get_engines(self.app):
+            engine.dispose(close=False)
+
     def on_testing_start(self, app):
         self.db_init_with_clear()
 
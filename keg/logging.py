@@ -84,6 +84,19 @@ class Logging(object):
 
         self.add_handler(handler)
 
+    def reopen_syslog(self):
+        """
+            Replace the syslog handler with a new one, e.g. in a forked worker process, so that it
+            doesn't share its socket with the parent process.
+        """
+        for logger in self.loggers:
+            for handler in list(logger.handlers):
+                if hasattr(handler, '_from_keg_logging') and isinstance(handler, SysLogHandler):
+                    logger.removeHandler(handler)
+                    handler.close()
+        if self.syslog_enabled:
+            self.init_syslog()
+
     def add_handler(self, handler):
         for logger in self.loggers:
             handler._from_keg_logging = True
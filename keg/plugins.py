@@ -0,0 +1,169 @@
+"""
+    Index of the CLI commands installed packages provide through entry points.  Scanning the
+    metadata of every installed distribution is slow in large environments, so the index is cached
+    on disk until the distributions on ``sys.path`` change, i.e. a package is installed or removed.
+"""
+import hashlib
+import importlib
+import json
+import os
+import os.path as osp
+import re
+import sys
+
+import appdirs
+
+from keg.utils import write_atomic
+
+COMMAND_GROUPS = ('flask.commands', 'keg.commands')
+
+# same as importlib.metadata.EntryPoint.pattern
+_value_pattern = re.compile(
+    r'(?P<module>[\w.]+)\s*'
+    r'(:\s*(?P<attr>[\w.]+)\s*)?'
+    r'((?P<extras>\[.*\])\s*)?$'
+)
+
+
+# metadata directories of installed distributions, including editable and legacy installs
+_metadata_suffixes = ('.dist-info', '.egg-info', '.egg-link')
+
+
+def distributions_key():
+    """
+        The Python version, the sys.path entries and the metadata of the distributions installed in
+        them: names and modification times.  Installing, upgrading or removing a distribution
+        changes it, other files, e.g. the sources in the working directory, don't.
+    """
+    key = [sys.version]
+    for dpath in sys.path:
+        try:
+            with os.scandir(dpath or '.') as entries:
+                distributions = sorted(
+                    [entry.name, entry.stat().st_mtime_ns] for entry in entries
+                    if entry.name.endswith(_metadata_suffixes)
+                )
+        except NotADirectoryError:
+            # a zip file
+            distributions = os.stat(dpath).st_mtime_ns
+        except OSError:
+            distributions = None
+        key.append([dpath, distributions])
+    return key
+
+
+def load_entry_point(value):
+    """ The object an entry point value like ``package.module:attr`` refers to. """
+    match = _value_pattern.match(value)
+    obj = importlib.import_module(match.group('module'))
+    for attr in filter(None, (match.group('attr') or '').split('.')):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def scan_entry_points(groups):
+    """ (group, name, value) of the installed entry points in groups. """
+    try:
+        from importlib import metadata
+    except ImportError:
+        # Python 3.7
+        import pkg_resources
+        for group in groups:
+            for ep in pkg_resources.iter_entry_points(group):
+                value = ep.module_name
+                if ep.attrs:
+                    value += ':' + '.'.join(ep.attrs)
+                yield group, ep.name, value
+        return
+
+    all_entry_points = metadata.entry_points()
+    for group in groups:
+        if hasattr(all_entry_points, 'select'):
+            group_entry_points = all_entry_points.select(group=group)
+        else:
+            # Python < 3.10
+            group_entry_points = all_entry_points.get(group, ())
+        for ep in group_entry_points:
+            yield group, ep.name, ep.value
+
+
+class EntryPointIndex(object):
+    """
+        The entry points of ``groups``, keyed by name, with the short help and hidden flag of
+        their commands once they have been loaded.  When names clash, the last group wins, the same
+        as if the commands were added to a click group in order.
+    """
+    def __init__(self, groups=COMMAND_GROUPS, cache_dpath=None):
+        self.groups = tuple(groups)
+        self.cache_dpath = cache_dpath
+        self.entries = None
+        self.key = None
+
+    def cache_fpath(self):
+        if self.cache_dpath is None:
+            return None
+        digest = hashlib.sha1(
+            '\0'.join((sys.executable,) + self.groups).encode('utf-8')
+        ).hexdigest()
+        return osp.join(self.cache_dpath, 'entry-points-{}.json'.format(digest[:16]))
+
+    def cache_key(self):
+        return distributions_key()
+
+    def load(self):
+        if self.entries is not None:
+            return self.entries
+
+        fpath = self.cache_fpath()
+        self.key = self.cache_key()
+        if fpath is not None:
+            try:
+                with open(fpath) as fo:
+                    cached = json.load(fo)
+                if cached['key'] == self.key:
+                    self.entries = cached['entries']
+                    return self.entries
+            except (OSError, ValueError, KeyError, TypeError):
+                # missing, unreadable or from an incompatible version: scan
+                pass
+
+        self.entries = {}
+        for group, name, value in scan_entry_points(self.groups):
+            self.entries[name] = dict(group=group, value=value, short_help=None, hidden=False)
+        self.save()
+        return self.entries
+
+    def save(self):
+        fpath = self.cache_fpath()
+        if fpath is None:
+            return False
+        data = json.dumps(dict(key=self.key, entries=self.entries))
+        try:
+            os.makedirs(self.cache_dpath, exist_ok=True)
+            # a concurrent process must never read a partial index
+            write_atomic(fpath, data.encode('utf-8'))
+        except OSError:
+            return False
+        return True
+
+    def record_command(self, name, command):
+        """ Cache the short help of a loaded command, so listing it doesn't need its module. """
+        entry = self.load()[name]
+        short_help = command.get_short_help_str(limit=sys.maxsize)
+        if entry['short_help'] != short_help or entry['hidden'] != command.hidden:
+            entry['short_help'] = short_help
+            entry['hidden'] = command.hidden
+            self.save()
+
+
+def user_cache_dpath(appname):
+    """ The user's cache directory for appname, under ``XDG_CACHE_HOME`` when it's set. """
+    # appdirs only looks at XDG_CACHE_HOME on Linux
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME')
+    if xdg_cache_home:
+        return osp.join(xdg_cache_home, appname)
+    return appdirs.user_cache_dir(appname, appauthor=False)
+
+
+def default_cache_dpath():
+    return user_cache_dpath('keg')
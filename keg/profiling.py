@@ -0,0 +1,161 @@
+"""
+    Startup instrumentation for Keg.init().  The app's StartupProfile is active while init() runs,
+    so code called during init can record imports and signal receivers on it without needing a
+    reference to the app.
+
+    Also, the memory usage of processes, to check how much of a preloaded app is shared by forked
+    workers.
+"""
+from contextlib import contextmanager
+import contextvars
+import os
+import time
+
+from keg.extensions import gettext as _
+
+_active_profile = contextvars.ContextVar('keg_startup_profile', default=None)
+
+
+def _callable_name(func):
+    return '{}.{}'.format(getattr(func, '__module__', None),
+                          getattr(func, '__qualname__', repr(func)))
+
+
+class StartupProfile(object):
+    """
+        Wall time of each init phase, of the modules imported through ``visit_modules`` and
+        components, and of the receivers of the signals sent during init.
+    """
+    def __init__(self):
+        # (phase name, seconds) in the order they ran
+        self.phases = []
+        # (dotted path, seconds)
+        self.imports = []
+        # (signal name, receiver name, seconds)
+        self.signals = []
+        self.total = None
+
+    @contextmanager
+    def activate(self):
+        token = _active_profile.set(self)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.total = time.perf_counter() - start
+            _active_profile.reset(token)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def run(self, name, func, *args, **kwargs):
+        with self.phase(name):
+            return func(*args, **kwargs)
+
+    def as_dict(self):
+        return dict(
+            total=self.total,
+            phases=dict(self.phases),
+            imports=dict(self.imports),
+            signals=[
+                dict(signal=signal_name, receiver=receiver_name, seconds=seconds)
+                for signal_name, receiver_name, seconds in self.signals
+            ],
+        )
+
+    def report(self):
+        """ Lines of text summarizing the profile, slowest imports and receivers first. """
+        def ms(seconds):
+            return '{:.1f}ms'.format(seconds * 1000)
+
+        lines = [_('Phases:')]
+        lines.extend('    {}: {}'.format(name, ms(seconds)) for name, seconds in self.phases)
+        if self.total is not None:
+            lines.append('    {}: {}'.format(_('total'), ms(self.total)))
+
+        lines.append(_('Imports:'))
+        lines.extend(
+            '    {}: {}'.format(dotted_path, ms(seconds))
+            for dotted_path, seconds in sorted(self.imports, key=lambda row: -row[1])
+        )
+
+        lines.append(_('Signal receivers:'))
+        lines.extend(
+            '    {} -> {}: {}'.format(signal_name, receiver_name, ms(seconds))
+            for signal_name, receiver_name, seconds in sorted(self.signals, key=lambda row: -row[2])
+        )
+        return lines
+
+
+def active_profile():
+    return _active_profile.get()
+
+
+@contextmanager
+def timed_import(dotted_path):
+    """ Record the time taken by the import in the body, if a startup profile is active. """
+    profile = _active_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.imports.append((dotted_path, time.perf_counter() - start))
+
+
+def send(signal, sender, **kwargs):
+    """
+        Same as ``signal.send(sender, **kwargs)`` but, if a startup profile is active, each
+        receiver is timed.
+    """
+    profile = _active_profile.get()
+    if profile is None or signal.is_muted:
+        return signal.send(sender, **kwargs)
+
+    results = []
+    for receiver in signal.receivers_for(sender):
+        start = time.perf_counter()
+        try:
+            results.append((receiver, receiver(sender, **kwargs)))
+        finally:
+            profile.signals.append(
+                (signal.name, _callable_name(receiver), time.perf_counter() - start)
+            )
+    return results
+
+
+# fields of /proc/<pid>/smaps_rollup, in kB
+MEMORY_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_usage(pid=None):
+    """
+        Memory of the process in kB, keyed by MEMORY_FIELDS, plus the ``Shared`` and ``Private``
+        totals.  Linux only, reads ``/proc/<pid>/smaps_rollup``.
+    """
+    usage = dict.fromkeys(MEMORY_FIELDS, 0)
+    with open('/proc/{}/smaps_rollup'.format(pid or os.getpid())) as fo:
+        for line in fo:
+            key, _sep, value = line.partition(':')
+            if key in usage:
+                usage[key] = int(value.split()[0])
+    usage['Shared'] = usage['Shared_Clean'] + usage['Shared_Dirty']
+    usage['Private'] = usage['Private_Clean'] + usage['Private_Dirty']
+    return usage
+
+
+def child_pids(pid):
+    """ PIDs of the child processes of pid, e.g. the workers of a pre-fork server. """
+    pids = []
+    task_dpath = '/proc/{}/task'.format(pid)
+    for task_id in os.listdir(task_dpath):
+        with open(os.path.join(task_dpath, task_id, 'children')) as fo:
+            pids.extend(int(child) for child in fo.read().split())
+    return pids
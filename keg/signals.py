@@ -21,6 +21,10 @@ db_before_import = _signals.signal('db-before-import')
 
 testing_run_start = _signals.signal('testing-run-start')
 
+# Call in each worker process forked from a preloaded app, see Keg.post_fork().
+# Sender will be the application instance.
+post_fork = _signals.signal('post-fork')
+
 db_clear_pre = _signals.signal('db-clear-pre')
 db_clear_post = _signals.signal('db-clear-post')
 db_init_pre = _signals.signal('db-init-pre')
@@ -5,6 +5,8 @@ except ImportError:
     from flask.globals import _request_ctx_stack
     request_ctx = None
 
+from werkzeug.local import LocalProxy
+
 from keg.extensions import lazy_gettext as _
 
 
@@ -18,12 +20,13 @@ def _get_bc_request_context():
 
 
 def _keg_default_template_ctx_processor():
-    """Default template context processor.  Injects `assets`.
+    """Default template context processor.  Injects `assets`, which is a proxy so the request's
+    AssetManager is only created if the template uses it.
     """
     reqctx = _get_bc_request_context()
     rv = {}
     if reqctx:
-        rv['assets'] = reqctx.assets
+        rv['assets'] = LocalProxy(lambda: reqctx.assets)
     return rv
 
 from jinja2 import nodes  # noqa
@@ -32,7 +35,7 @@ from jinja2.ext import Extension  # noqa
 
 class AssetsExtension(Extension):
     # a set of names that trigger the extension.
-    tags = set(['assets_include', 'assets_content'])
+    tags = set(['assets_include', 'assets_content', 'assets_tags'])
 
     def __init__(self, environment):
         super(AssetsExtension, self).__init__(environment)
@@ -72,6 +75,11 @@ class AssetsExtension(Extension):
         return ''
 
     def parse_content(self, parser, stream, lineno):
+        if stream.current.value == 'assets_tags':
+            support_method = '_tags_support'
+        else:
+            support_method = '_content_support'
+
         # move from the current Name token to the next token in the stream, which should be the
         # first argument to asset_content tag.
         next(stream)
@@ -81,10 +89,15 @@ class AssetsExtension(Extension):
 
         # now return a `CallBlock` node that calls our support
         # helper method on this extension.
-        return nodes.CallBlock(self.call_method('_content_support', args),
+        return nodes.CallBlock(self.call_method(support_method, args),
                                [], [], []).set_lineno(lineno)
 
     def _content_support(self, asset_type, caller):
         """Helper callback."""
         ctx = _get_bc_request_context()
         return ctx.assets.combine_content(asset_type)
+
+    def _tags_support(self, asset_type, caller):
+        """Helper callback."""
+        ctx = _get_bc_request_context()
+        return ctx.assets.tags(asset_type)
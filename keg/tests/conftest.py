@@ -0,0 +1,12 @@
+import os
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def user_cache_home(tmp_path_factory):
+    """ Keep what Keg caches, e.g. the plugin command index, out of the user's cache directory. """
+    cache_home = str(tmp_path_factory.mktemp('cache'))
+    with mock.patch.dict(os.environ, XDG_CACHE_HOME=cache_home):
+        yield cache_home
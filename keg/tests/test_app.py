@@ -1,11 +1,17 @@
 from unittest import mock
 
+import flask
 import pytest
 import sqlalchemy as sa
+import werkzeug.routing
 
+from keg import signals
 from keg.app import Keg, KegAppError
+from keg.component import KegComponent
 from keg_apps.cli2.app import CLI2App
 from keg_apps.db2 import DB2App
+from keg_apps.templating.app import TemplatingApp
+from keg_apps.web.app import WebApp
 
 
 class TestInit(object):
@@ -51,3 +57,195 @@ class TestRouteDecorator(object):
 
         assert len(self.TRDApp._routes) == 2
         assert len(self.TRDApp2._routes) == 1
+
+
+class TestLazyWeb(object):
+
+    def test_deferred_until_url_map(self):
+        app = WebApp().init(use_test_profile=True, lazy_web=True)
+        assert app._web_deferred
+        assert 'blog' not in app._web_attributes['blueprints']
+        assert 'ensure_web' not in dict(app.startup_profile.phases)
+
+        assert app.url_map.bind('').match('/blog') == ('blog.blog', {})
+        assert app._web_deferred is None
+        assert 'blog' in app.blueprints
+        assert 'ensure_web' in dict(app.startup_profile.phases)
+
+        # the component's blueprint is registered only once
+        app.ensure_web()
+        assert len([rule for rule in app.url_map.iter_rules() if rule.endpoint == 'blog.blog']) == 1
+
+    def test_app_context_server_name(self):
+        app = WebApp().init(use_test_profile=True, lazy_web=True,
+                            config={'SERVER_NAME': 'keg.example.com'})
+        with app.app_context():
+            assert app._web_deferred
+
+            # the URL map is only needed to build a URL
+            assert flask.url_for('blog.blog') == 'http://keg.example.com/blog'
+            assert app._web_deferred is None
+
+    def test_request(self):
+        app = WebApp().init(use_test_profile=True, lazy_web=True)
+        resp = app.test_client().get('/blog')
+        assert resp.status_code == 200
+        assert b'I am a blog' in resp.data
+
+    def test_failed_step(self):
+        app = WebApp().init(use_test_profile=True, lazy_web=True)
+        step = mock.Mock(side_effect=ImportError('deliberate import error'))
+        app.defer_web_init(step)
+        client = app.test_client()
+
+        with pytest.raises(ImportError, match='deliberate import error'):
+            client.get('/blog')
+        # later requests aren't served from the partly registered URL map
+        with pytest.raises(KegAppError) as exc_info:
+            client.get('/blog')
+        assert isinstance(exc_info.value.__cause__, ImportError)
+        with pytest.raises(KegAppError):
+            app.url_map.iter_rules()
+        step.assert_called_once_with()
+
+    def test_not_lazy(self):
+        app = WebApp().init(use_test_profile=True)
+        assert app._web_deferred is None
+        assert 'blog' in app.blueprints
+        # plain instance attributes, not stand-ins
+        assert isinstance(app.__dict__['url_map'], werkzeug.routing.Map)
+        assert 'create_url_adapter' not in app.__dict__
+
+        calls = []
+        app.defer_web_init(calls.append, 'now')
+        assert calls == ['now']
+
+
+class TestPreload(object):
+
+    def test_preload(self):
+        app = WebApp.preload(use_test_profile=True, lazy_web=True)
+        assert app._web_deferred is None
+        assert 'blog' in app.blueprints
+        assert isinstance(app.__dict__['url_map'], werkzeug.routing.Map)
+        assert app.config.frozen
+
+    def test_post_fork(self):
+        app = WebApp().init(use_test_profile=True)
+        calls = []
+
+        @signals.post_fork.connect_via(app)
+        def on_post_fork(sender):
+            calls.append(sender)
+
+        with mock.patch.object(app.logging, 'reopen_syslog') as m_reopen_syslog, \
+                mock.patch('keg.web.shutdown_loader_executor') as m_shutdown:
+            app.post_fork()
+
+        m_reopen_syslog.assert_called_once_with()
+        m_shutdown.assert_called_once_with()
+        assert calls == [app]
+
+    def test_post_fork_db(self):
+        app = WebApp().init(use_test_profile=True)
+        app.db_manager = mock.Mock()
+        app.post_fork()
+        app.db_manager.dispose_engines.assert_called_once_with()
+
+
+class TestWarmUp(object):
+
+    @mock.patch('keg.app.gc')
+    def test_init(self, m_gc):
+        app = WebApp().init(use_test_profile=True, lazy_web=True,
+                            config={'KEG_WARMUP_ENABLED': True})
+        assert 'warm_up' in dict(app.startup_profile.phases)
+        assert app._web_deferred is None
+        m_gc.freeze.assert_called_once_with()
+
+        # templates are compiled and cached by the Jinja environment
+        with mock.patch.object(app.jinja_env.loader, 'get_source') as m_get_source:
+            app.jinja_env.get_template('blog/blog.html')
+        m_get_source.assert_not_called()
+
+        blog_view = app.view_functions['blog.blog'].view_class
+        assert blog_view.__dict__.get('_dispatch_plan') is not None
+
+    @mock.patch('keg.app.gc')
+    def test_template_extensions(self, m_gc):
+        app = TemplatingApp().init(use_test_profile=True)
+        with mock.patch.object(app.jinja_env, 'get_template') as m_get_template:
+            app.warm_up()
+        template_names = [call.args[0] for call in m_get_template.call_args_list]
+        assert 'assets_in_template.html' in template_names
+        # assets next to the templates are not compiled
+        assert not [name for name in template_names if not name.endswith('.html')]
+
+    @mock.patch('keg.app.gc')
+    def test_not_enabled(self, m_gc):
+        app = WebApp().init(use_test_profile=True)
+        assert 'warm_up' not in dict(app.startup_profile.phases)
+        m_gc.freeze.assert_not_called()
+
+
+class TestRegisteredComponents(object):
+    components = ['keg_apps.web.comments', 'keg_apps.web.news', 'keg_apps.web.blog']
+
+    def init_app(self, **config):
+        config.setdefault('KEG_REGISTERED_COMPONENTS', self.components)
+        return WebApp().init(use_test_profile=True, config=config)
+
+    def test_order(self):
+        app = self.init_app()
+        assert [name for name in app.blueprints if name in ('blog', 'comments', 'news')] == [
+            # comments requires both, they keep their registered order
+            'news', 'blog', 'comments',
+        ]
+        assert app.test_client().get('/comments').data == b'comments'
+
+    def test_component_order(self):
+        app = self.init_app()
+        components = {
+            'a': KegComponent('a', requires=('c',)),
+            'b': KegComponent('b'),
+            'c': KegComponent('c'),
+        }
+        assert app.component_order(components) == ['c', 'a', 'b']
+
+        # without requirements, the registered order is kept
+        components = {name: KegComponent(name) for name in ('c', 'a', 'b')}
+        assert app.component_order(components) == ['c', 'a', 'b']
+
+    def test_missing_requirement(self):
+        with pytest.raises(KegAppError, match='keg_apps.web.comments requires unregistered'
+                                              ' components: keg_apps.web.news'):
+            self.init_app(KEG_REGISTERED_COMPONENTS=['keg_apps.web.comments', 'keg_apps.web.blog'])
+
+    def test_circular_requirement(self):
+        app = self.init_app()
+        components = {
+            'a': KegComponent('a', requires=('b',)),
+            'b': KegComponent('b', requires=('a',)),
+        }
+        with pytest.raises(KegAppError, match='Circular dependency between: a, b'):
+            app.component_order(components)
+
+    @mock.patch('keg.app.prefetch_modules')
+    def test_prefetch(self, m_prefetch_modules):
+        self.init_app(KEG_COMPONENT_PREFETCH_WORKERS=4)
+        m_prefetch_modules.assert_called_once_with(
+            ['keg_apps.web.news.views', 'keg_apps.web.blog.views', 'keg_apps.web.comments.views'],
+            4,
+        )
+
+    @mock.patch('keg.app.prefetch_modules')
+    def test_prefetch_lazy_web(self, m_prefetch_modules):
+        WebApp().init(use_test_profile=True, lazy_web=True,
+                      config={'KEG_REGISTERED_COMPONENTS': self.components,
+                              'KEG_COMPONENT_PREFETCH_WORKERS': 4})
+        m_prefetch_modules.assert_called_once_with([], 4)
+
+    @mock.patch('keg.app.prefetch_modules')
+    def test_prefetch_disabled(self, m_prefetch_modules):
+        self.init_app()
+        m_prefetch_modules.assert_not_called()
@@ -1,8 +1,12 @@
+import json
 import os
+from unittest import mock
 
+import flask
+from flask_webtest import TestApp
 import pytest
 
-from keg.assets import AssetManager, AssetException
+from keg.assets import AssetBundler, AssetCache, AssetManager, AssetException
 from keg_apps.templating.app import TemplatingApp
 
 
@@ -47,3 +51,129 @@ class TestAssets(object):
 
         assert len(am.content['js']) == 1
         assert len(am.content['css']) == 0
+
+    def test_shared_cache(self, app):
+        am = AssetManager(app)
+        assert am.cache is app.asset_cache
+        am.load_related('assets_in_template.html')
+
+        loader = app.jinja_env.loader
+        with mock.patch.object(loader, 'get_source', wraps=loader.get_source) as m_get_source, \
+                mock.patch.object(app.jinja_env, 'auto_reload', False):
+            am = AssetManager(app)
+            am.load_related('assets_in_template.html')
+            with pytest.raises(AssetException):
+                am.load_related('_not_cached.html')
+            with pytest.raises(AssetException):
+                am.load_related('_not_cached.html')
+        assert len(am.content['js']) == 1
+        # only the missing .js & .css assets needed a lookup, and only the first time
+        assert m_get_source.call_count == 2
+
+    def test_cache_refreshed_when_out_of_date(self, app):
+        cache = AssetCache(app.jinja_env)
+        uptodate = mock.Mock(return_value=True)
+        with mock.patch.object(app.jinja_env.loader, 'get_source',
+                               return_value=('//one', 'foo.js', uptodate)) as m_get_source:
+            assert cache.get('foo.js') == ('foo.js', '//one')
+            assert cache.get('foo.js') == ('foo.js', '//one')
+            assert m_get_source.call_count == 1
+
+            uptodate.return_value = False
+            m_get_source.return_value = ('//two', 'foo.js', uptodate)
+            with mock.patch.object(app.jinja_env, 'auto_reload', True):
+                assert cache.get('foo.js') == ('foo.js', '//two')
+            assert m_get_source.call_count == 2
+
+            # without auto reload, the cached asset is used regardless
+            with mock.patch.object(app.jinja_env, 'auto_reload', False):
+                cache.get('foo.js')
+            assert m_get_source.call_count == 2
+
+    def test_combine_content(self, app):
+        cache = AssetCache(app.jinja_env)
+        content = [('foo.js', 'foo.js', '//foo'), ('bar.js', 'bar.js', '//bar')]
+        combined = cache.combine(content)
+        assert combined == '\n\n'.join([
+            '/********************* asset: foo.js *********************/',
+            '//foo',
+            '/********************* asset: bar.js *********************/',
+            '//bar',
+        ])
+        assert cache.combine(list(content)) is combined
+        assert cache.combine(content[:1]) is not combined
+
+
+class TestAssetBundles(object):
+
+    @pytest.fixture
+    def bundles_dpath(self, app, tmp_path):
+        AssetBundler(app, str(tmp_path)).build()
+        return tmp_path
+
+    @pytest.fixture
+    def manifest(self, bundles_dpath):
+        with open(bundles_dpath / 'manifest.json') as fo:
+            return json.load(fo)
+
+    @pytest.fixture
+    def bundles_app(self, bundles_dpath):
+        from keg_apps.templating.app import TemplatingApp
+        return TemplatingApp().init(use_test_profile=True, config={
+            'KEG_ASSETS_BUNDLE_ENABLED': True,
+            'KEG_ASSETS_BUNDLE_DIR': str(bundles_dpath),
+        })
+
+    def test_build(self, app, tmp_path):
+        bundler = AssetBundler(app, str(tmp_path))
+        manifest = bundler.build()
+
+        assert sorted(manifest) == [
+            'assets_in_template.css', 'assets_in_template.js', 'assets_include_single.js',
+        ]
+        js_bundle = manifest['assets_in_template.js']
+        assert js_bundle.startswith('assets_in_template.') and js_bundle.endswith('.js')
+        assert js_bundle == bundler.bundle_name('assets_in_template.js',
+                                                '//assets_in_template js file\n')
+        with open(tmp_path / 'manifest.json') as fo:
+            assert json.load(fo) == manifest
+        with open(tmp_path / manifest['assets_in_template.js']) as fo:
+            assert fo.read().strip() == '//assets_in_template js file'
+
+        # the template with an invalid assets_include is reported, not bundled
+        assert [template_name for template_name, _ in bundler.errors] == [
+            'assets_with_params.html'
+        ]
+
+    def test_tags(self, bundles_app, manifest):
+        with bundles_app.test_request_context():
+            lines = flask.render_template('assets_tags.html').strip().splitlines()
+        assert lines == [
+            '<script src="/_assets/{}"></script>'.format(manifest['assets_in_template.js']),
+            '<script src="/_assets/{}"></script>'.format(manifest['assets_include_single.js']),
+            '<link rel="stylesheet" href="/_assets/{}">'.format(manifest['assets_in_template.css']),
+        ]
+
+    def test_tags_inline_without_bundle(self, bundles_app, manifest):
+        del bundles_app.asset_cache.bundles['assets_in_template.js']
+        with bundles_app.test_request_context():
+            lines = flask.render_template('assets_tags.html').strip().splitlines()
+        assert lines[:4] == [
+            '<script>',
+            '/********************* asset: assets_in_template.js *********************/',
+            '',
+            '//assets_in_template js file',
+        ]
+        assert lines[-3:] == [
+            '</script>',
+            '<script src="/_assets/{}"></script>'.format(manifest['assets_include_single.js']),
+            '<link rel="stylesheet" href="/_assets/{}">'.format(manifest['assets_in_template.css']),
+        ]
+
+    def test_bundle_view(self, bundles_app, manifest):
+        testapp = TestApp(bundles_app)
+        resp = testapp.get('/_assets/' + manifest['assets_in_template.js'])
+        assert resp.text.strip() == '//assets_in_template js file'
+        assert resp.headers['Cache-Control'] == 'public, max-age=31536000'
+
+        testapp.get('/_assets/manifest-missing.json', status=404)
@@ -1,13 +1,22 @@
+import json
 import os
+import sys
 from unittest import mock
 
+import click
 import pytest
+import werkzeug.routing
 
+from keg import signals
+import keg.cli
+import keg.plugins
 from keg.cli import dotenv, get_load_dotenv
-from keg.testing import CLIBase, app_config
+from keg.testing import CLIBase, app_config, invoke_command
 from keg_apps.cli import CLIApp
 from keg_apps.cli2.app import CLI2App
 from keg_apps.db.app import DBApp
+from keg_apps.templating.app import TemplatingApp
+from keg_apps.web.app import WebApp
 
 
 need_dotenv = pytest.mark.skipif(
@@ -35,6 +44,22 @@ class TestCLI(CLIBase):
         result = self.invoke(cmd_name='baz', exit_code=2)
         assert 'No such command \'baz\'' in result.output
 
+    @pytest.mark.parametrize('flask_debug, debug', [('1', True), ('0', False)])
+    def test_frozen_config(self, flask_debug, debug):
+        apps = []
+
+        def on_init_complete(app):
+            apps.append(app)
+
+        # FLASK_DEBUG is given to init(), a frozen config can't change it afterwards
+        with app_config(KEG_CONFIG_FREEZE=True), \
+                signals.init_complete.connected_to(on_init_complete):
+            result = self.invoke(env={'FLASK_DEBUG': flask_debug})
+        assert 'hello keg test' in result.output
+        app, = apps
+        assert app.config.frozen
+        assert app.debug is debug
+
     @need_dotenv
     def test_dotenv(self):
         test_dir = os.path.dirname(__file__)
@@ -119,9 +144,11 @@ class TestCLI2(CLIBase):
     def test_help_all(self):
         expected_lines = [
             'Usage', '', 'Options', '--profile', '--quiet', '--help-all', '--help',
-            'Commands', 'develop', 'Commands', 'config', 'db', 'Commands', 'clear',
-            'init', 'routes',
-            'run', 'shell', 'templates', 'hello1', 'is-not-quiet', 'is-quiet', 'reverse',
+            'Commands', 'develop', 'Commands', 'assets', 'Commands', 'build', 'batch', 'config',
+            'db', 'Commands', 'clear',
+            'init', 'memory-report', 'routes', 'Commands', 'bench', 'run', 'serve-cli', 'shell',
+            'startup-profile', 'templates',
+            'hello1', 'is-not-quiet', 'is-quiet', 'reverse',
             ''
         ]
         result = self.invoke('--help-all')
@@ -146,6 +173,13 @@ class TestConfigCommand(CLIBase):
         # command worked as expected.
         assert 'USE_X_SENDFILE = False' in result.output
 
+    def test_timings(self):
+        result = self.invoke()
+        lines = result.output.splitlines()
+        idx = lines.index('Config timings:')
+        assert lines[idx + 1].startswith('    config file discovery: ')
+        assert lines[idx + 1].endswith('ms')
+
     def test_database_disabled(self):
         result = self.invoke(cmd_name='develop db')
         assert 'Database not enabled for this app.  No subcommands available.' in result.output
@@ -157,6 +191,201 @@ class TestConfigCommand(CLIBase):
         assert 'Bar' in result.output
 
 
+class TestStartupProfileCommand(CLIBase):
+    app_cls = CLIApp
+    cmd_name = 'develop startup-profile'
+
+    def test_output(self):
+        result = self.invoke()
+        lines = result.output.splitlines()
+        assert lines[0] == 'Phases:'
+        assert lines[1].startswith('    init_config: ')
+        assert 'Imports:' in lines
+        assert 'Signal receivers:' in lines
+
+
+class TestMemoryReportCommand(CLIBase):
+    app_cls = CLIApp
+    cmd_name = 'develop memory-report'
+
+    @mock.patch('keg.profiling.memory_usage')
+    def test_output(self, m_memory_usage):
+        m_memory_usage.return_value = dict(Rss=2048, Pss=1024, Shared=1536, Private=512)
+        result = self.invoke('123', '456')
+        assert result.output.splitlines() == [
+            '     PID         Rss         Pss      Shared     Private',
+            '     123     2048 kB     1024 kB     1536 kB      512 kB',
+            '     456     2048 kB     1024 kB     1536 kB      512 kB',
+        ]
+        assert m_memory_usage.call_args_list == [mock.call(123), mock.call(456)]
+
+    @mock.patch('keg.profiling.memory_usage')
+    @mock.patch('keg.profiling.child_pids')
+    def test_children(self, m_child_pids, m_memory_usage):
+        m_child_pids.return_value = [7, 8]
+        m_memory_usage.return_value = dict(Rss=0, Pss=0, Shared=0, Private=0)
+        self.invoke('--children', '6')
+        m_child_pids.assert_called_once_with(6)
+        assert m_memory_usage.call_args_list == [mock.call(7), mock.call(8)]
+
+
+class TestBatchCommand(CLIBase):
+    app_cls = CLIApp
+    cmd_name = 'develop batch'
+
+    def test_commands(self):
+        apps = []
+
+        def on_init_complete(app):
+            apps.append(app)
+
+        commands = '\n'.join([
+            '# a comment',
+            'hello',
+            '',
+            'foo2 "keg batch"',
+        ])
+        with signals.init_complete.connected_to(on_init_complete):
+            result = self.invoke(input=commands)
+        assert 'hello keg test\nhello keg batch\n' in result.output
+        assert '2 commands ran, 0 failed.' in result.output
+
+        # the app was initialized once
+        assert len(apps) == 1
+
+    def test_failures(self):
+        commands = '\n'.join(['catch-error', 'baz', 'hello'])
+        result = self.invoke(input=commands, exit_code=1)
+        assert 'deliberate exception for testing' in result.output
+        assert "No such command 'baz'" in result.output
+        assert 'hello keg test' in result.output
+        assert 'Line 1 exited with 1: catch-error' in result.output
+        assert 'Line 2 exited with 2: baz' in result.output
+        assert '3 commands ran, 2 failed.' in result.output
+
+    def test_workers(self, tmp_path):
+        commands_fpath = tmp_path / 'commands.txt'
+        commands_fpath.write_text('\n'.join(['foo2 {}'.format(i) for i in range(10)]))
+        result = self.invoke('--workers', '4', str(commands_fpath))
+        output_lines = [line for line in result.output.splitlines() if line.startswith('hello')]
+        assert sorted(output_lines) == sorted('hello {}'.format(i) for i in range(10))
+        assert '10 commands ran, 0 failed.' in result.output
+
+    def test_syntax_error(self):
+        result = self.invoke(input='hello\nfoo2 "bar\n', exit_code=2)
+        assert 'Line 2: No closing quotation' in result.output
+        assert 'hello keg test' not in result.output
+
+    @pytest.mark.parametrize('line, option', [
+        ('--quiet hello', '--quiet'),
+        ('--profile foo hello', '--profile'),
+        ('--profile=foo hello', '--profile'),
+    ])
+    def test_app_options(self, line, option):
+        result = self.invoke(input='hello\n' + line, exit_code=2)
+        assert 'Line 2: {} applies to the whole batch'.format(option) in result.output
+        assert 'hello keg test' not in result.output
+
+
+class TestLazyWebCommand(CLIBase):
+    app_cls = WebApp
+    cmd_name = 'develop routes'
+
+    @mock.patch.object(WebApp, 'cli_lazy_web', True)
+    def test_routes(self):
+        result = self.invoke()
+        assert 'blog.blog' in result.output
+
+
+class TestRoutesCommand(CLIBase):
+    app_cls = WebApp
+    cmd_name = 'develop routes'
+
+    def test_text(self):
+        result = self.invoke()
+        assert [line.split() for line in result.output.splitlines()
+                if line.startswith('blog.blog ')] == [['blog.blog', 'GET,HEAD,OPTIONS', '/blog']]
+
+    def test_json(self):
+        result = self.invoke('--format', 'json')
+        rows = json.loads(result.output)
+        assert dict(endpoint='blog.blog', methods=['GET', 'HEAD', 'OPTIONS'], rule='/blog') in rows
+        assert rows == sorted(rows, key=lambda row: row['endpoint'])
+
+    def test_bench(self):
+        result = self.invoke('bench', '--repeat', '2', '--format', 'json')
+        data = json.loads(result.output)
+        results = {result['endpoint']: result for result in data['results']}
+        assert results['blog.blog']['path'] == '/blog'
+        assert results['other.loaders']['path'] == '/loaders/1'
+        assert results['static']['path'] == '/static/sample'
+        # every sample path matches the route it was built for
+        assert all(result['matched'] == result['endpoint'] for result in data['results'])
+        assert data['skipped'] == []
+
+    def test_route_samples(self):
+        class TagConverter(werkzeug.routing.AnyConverter):
+            """ Items come from the database at match time, there are none to sample from. """
+            def __init__(self, url_map):
+                super().__init__(url_map)
+
+        url_map = werkzeug.routing.Map([
+            werkzeug.routing.Rule('/pages/<int(min=5):page>', endpoint='pages'),
+            werkzeug.routing.Rule('/colors/<any(red, blue):color>', endpoint='colors'),
+            werkzeug.routing.Rule('/tags/<tag:tag>', endpoint='tags'),
+            werkzeug.routing.Rule('/hosted', endpoint='hosted', host='example.com'),
+        ], converters=dict(tag=TagConverter))
+        samples, skipped = keg.cli.route_samples(url_map)
+        assert [(path, endpoint) for _method, path, endpoint in samples] == [
+            ('/pages/5', 'pages'),
+            ('/colors/blue', 'colors'),
+        ]
+        assert skipped == [
+            ('/tags/<tag:tag>', 'tags', 'any() converter has no values'),
+            ('/hosted', 'hosted', 'host or subdomain'),
+        ]
+
+    def test_bench_paths(self):
+        result = self.invoke('bench', '--repeat', '2', '/blog', '/not-a-route')
+        lines = result.output.splitlines()
+        assert len(lines) == 3
+        assert any(line.endswith('GET /blog -> blog.blog') for line in lines)
+        assert any(line.endswith('GET /not-a-route -> NotFound') for line in lines)
+        assert 'Matched 2 paths in' in lines[-1]
+
+
+class TestTemplatesCommand(CLIBase):
+    app_cls = WebApp
+    cmd_name = 'develop templates'
+
+    def test_text(self):
+        result = self.invoke()
+        lines = result.output.splitlines()
+        blog_line, = [line for line in lines if line.endswith(os.path.join('blog', 'templates'))]
+        assert lines[lines.index(blog_line) + 1] == '    blog/blog.html'
+
+    def test_json(self):
+        result = self.invoke('--format', 'json')
+        sources = json.loads(result.output)
+        assert sources[0]['source'] == 'app'
+        blog, = [source for source in sources if source['source'] == 'blog']
+        assert blog['templates'] == ['blog/blog.html']
+        assert blog['shadowed'] == []
+
+
+class TestAssetsCommand(CLIBase):
+    app_cls = TemplatingApp
+    cmd_name = 'develop assets build'
+
+    def test_build(self, tmp_path):
+        result = self.invoke('--output-dir', str(tmp_path))
+        lines = result.output.splitlines()
+        assert lines[0].startswith('Skipped assets_with_params.html: ')
+        assert lines[1].startswith('assets_in_template.css -> assets_in_template.')
+        assert lines[-1] == 'Bundles written to: {}'.format(tmp_path)
+        assert (tmp_path / 'manifest.json').exists()
+
+
 class TestDatabaseCommands(CLIBase):
     app_cls = DBApp
     cmd_name = 'develop db'
@@ -183,3 +412,177 @@ class TestDatabaseCommands(CLIBase):
         result = self.invoke('clear', '--yes')
         assert 'Database cleared' in result.output
         m_db_clear.assert_called_once_with()
+
+
+class TestPluginCommands(object):
+    entry_points = [('keg.commands', 'plugin-hello', 'keg_apps.cli_plugin:hello_command')]
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        self.cache_dpath = tmp_path
+        with mock.patch('keg.plugins.default_cache_dpath', return_value=str(tmp_path)), \
+                mock.patch('keg.plugins.scan_entry_points',
+                           return_value=self.entry_points) as self.m_scan:
+            sys.modules.pop('keg_apps.cli_plugin', None)
+            yield
+
+    def invoke(self, *args):
+        # a new app class, so its CLI group loads the plugin commands again
+        app_cls = type('PluginCLIApp', (CLIApp, ), {'_cli': None})
+        return invoke_command(app_cls, *args)
+
+    def test_command(self):
+        result = self.invoke('plugin-hello')
+        assert result.output == 'hello from plugin\n'
+
+    def test_help_is_lazy(self):
+        # the short help isn't in the index until the command has been loaded once
+        result = self.invoke('--help')
+        assert 'Say hello from a plugin.' in result.output
+        assert 'keg_apps.cli_plugin' in sys.modules
+
+        sys.modules.pop('keg_apps.cli_plugin')
+        result = self.invoke('--help')
+        assert 'Say hello from a plugin.' in result.output
+        assert 'keg_apps.cli_plugin' not in sys.modules
+
+        # the index was read from the cache
+        assert self.m_scan.call_count == 1
+
+    def test_command_help(self):
+        result = self.invoke('plugin-hello', '--help')
+        assert 'Usage: root plugin-hello [OPTIONS]' in result.output
+
+    def test_cache_invalidated(self):
+        self.invoke('plugin-hello')
+        with mock.patch('keg.plugins.EntryPointIndex.cache_key', return_value=['changed']):
+            self.invoke('plugin-hello')
+        assert self.m_scan.call_count == 2
+
+    def test_distributions_key(self, tmp_path, monkeypatch):
+        monkeypatch.syspath_prepend(str(tmp_path))
+        key = keg.plugins.distributions_key()
+        (tmp_path / 'module.py').write_text('')
+        assert keg.plugins.distributions_key() == key
+
+        (tmp_path / 'plugin-1.0.dist-info').mkdir()
+        assert keg.plugins.distributions_key() != key
+
+    def test_cache_dpath(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+        assert keg.plugins.user_cache_dpath('keg') == str(tmp_path / 'keg')
+
+    def test_cache_not_writable(self):
+        with mock.patch('keg.plugins.default_cache_dpath',
+                        return_value=str(self.cache_dpath / 'file' / 'cache')):
+            (self.cache_dpath / 'file').write_text('')
+            result = self.invoke('plugin-hello')
+        assert result.output == 'hello from plugin\n'
+
+
+class TestCommandManifest(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        self.fpath = str(tmp_path / 'cli-manifest.json')
+        with mock.patch('keg.cli.CLILoader.manifest_fpath', return_value=self.fpath):
+            self.app_cls = self.create_app_cls()
+            self.inits = []
+
+            def on_init_complete(app):
+                if isinstance(app, self.app_cls):
+                    self.inits.append(app)
+
+            signals.init_complete.connect(on_init_complete)
+            yield
+            signals.init_complete.disconnect(on_init_complete)
+
+    def create_app_cls(self, **attrs):
+        attrs.setdefault('cli_manifest_enabled', True)
+        app_cls = type('ManifestCLIApp', (CLIApp, ), dict(attrs, _cli=None))
+
+        @app_cls.cli.command('hello', short_help='Say hello.')
+        def hello():
+            click.echo('hello manifest')
+
+        @app_cls.cli.group('greet', help='Greetings.')
+        def greet():
+            pass
+
+        @greet.command('wave')
+        @click.argument('name')
+        def wave(name):
+            click.echo('waves at {}'.format(name))
+
+        return app_cls
+
+    def invoke(self, *args, **kwargs):
+        return invoke_command(self.app_cls, *args, **kwargs)
+
+    def test_help(self):
+        first = self.invoke('--help')
+        assert len(self.inits) == 1
+        assert os.path.exists(self.fpath)
+
+        second = self.invoke('--help')
+        # Flask names the group after the app once it has been loaded
+        assert second.output.splitlines()[1:] == first.output.splitlines()[1:]
+        assert 'Say hello.' in second.output
+        assert len(self.inits) == 1
+
+    def test_help_all(self):
+        first = self.invoke('--help-all')
+        second = self.invoke('--help-all')
+        assert second.output.splitlines()[1:] == first.output.splitlines()[1:]
+        assert '    wave' in second.output
+        assert len(self.inits) == 1
+
+    def test_group_help(self):
+        self.invoke('--help')
+        result = self.invoke('greet', exit_code=2)
+        assert 'Greetings.' in result.output
+        assert 'wave' in result.output
+        assert len(self.inits) == 1
+
+    def test_completion(self):
+        self.invoke('--help')
+        result = self.invoke(prog_name='root', env={
+            '_ROOT_COMPLETE': 'bash_complete', 'COMP_WORDS': 'root greet w', 'COMP_CWORD': '2',
+        })
+        assert result.output == 'plain,wave\n'
+        assert len(self.inits) == 1
+
+    def test_run_command(self):
+        self.invoke('--help')
+        result = self.invoke('greet', 'wave', 'keg')
+        assert result.output == 'waves at keg\n'
+        result = self.invoke('hello')
+        assert result.output == 'hello manifest\n'
+        assert len(self.inits) == 3
+
+    def test_out_of_date(self):
+        self.invoke('--help')
+        with mock.patch('keg.plugins.distributions_key', return_value=['changed']):
+            self.invoke('--help')
+        assert len(self.inits) == 2
+
+    def test_working_directory_changed(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.syspath_prepend('')
+        self.invoke('--help')
+
+        # files that aren't modules of the app or installed distributions don't matter
+        (tmp_path / 'notes.txt').write_text('changed')
+        self.invoke('--help')
+        assert len(self.inits) == 1
+
+        (tmp_path / 'myapp-1.0.dist-info').mkdir()
+        self.invoke('--help')
+        assert len(self.inits) == 2
+
+    def test_not_enabled(self):
+        self.app_cls = self.create_app_cls(cli_manifest_enabled=False)
+        self.invoke('--help')
+        self.invoke('--help')
+        assert not os.path.exists(self.fpath)
+        assert len(self.inits) == 2
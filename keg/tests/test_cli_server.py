@@ -0,0 +1,107 @@
+from io import StringIO
+import os
+import threading
+
+import pytest
+
+from keg import cli_client
+from keg.cli_server import CLIServer
+from keg_apps.cli import CLIApp
+from keg_apps.cli2.app import CLI2App
+
+
+class ServerBase(object):
+    app_cls = None
+
+    @pytest.fixture(autouse=True)
+    def server(self, tmp_path):
+        self.socket_path = str(tmp_path / 'cli.sock')
+        self.server = CLIServer(self.socket_path, self.app_cls.cli_loader_class(self.app_cls))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        yield
+        self.server.shutdown()
+        self.server.server_close()
+        thread.join()
+
+    def run(self, *argv, env=None, **kwargs):
+        stdout = StringIO()
+        stderr = StringIO()
+        if env is None:
+            env = dict(os.environ, **{self.app_cls.environ_key('USE_TEST_PROFILE'): 'true'})
+        exit_code = cli_client.run(self.socket_path, argv, env=env, stdout=stdout,
+                                   stderr=stderr, **kwargs)
+        return exit_code, stdout.getvalue(), stderr.getvalue()
+
+
+class TestCLIServer(ServerBase):
+    app_cls = CLIApp
+
+    def test_command(self):
+        assert self.run('hello') == (0, 'hello keg test\n', '')
+        assert self.run('foo2', 'bar') == (0, 'hello bar\n', '')
+
+        # the app was initialized once
+        assert len(self.server.apps) == 1
+
+    def test_missing_command(self):
+        exit_code, stdout, stderr = self.run('baz')
+        assert exit_code == 2
+        assert "No such command 'baz'" in stderr
+
+    def test_error(self):
+        exit_code, stdout, stderr = self.run('catch-error')
+        assert exit_code == 1
+        assert 'deliberate exception for testing' in stderr
+
+        # the daemon is still serving
+        assert self.run('hello')[0] == 0
+
+    def test_app_environ(self):
+        test_env = dict(os.environ, **{self.app_cls.environ_key('USE_TEST_PROFILE'): 'true'})
+        dev_env = dict(os.environ, **{self.app_cls.environ_key('CONFIG_PROFILE'): 'DevProfile'})
+        assert self.run('hello', env=test_env)[0] == 0
+        assert self.run('hello', env=dev_env)[0] == 0
+        assert self.run('hello', env=test_env)[0] == 0
+
+        # one app per environment, each with the profile its environment selects
+        assert sorted(app.config.profile for app in self.server.apps.values()) == \
+            ['DevProfile', 'TestProfile']
+
+    def test_socket_mode(self):
+        assert os.stat(self.socket_path).st_mode & 0o777 == 0o600
+
+    def test_socket_removed(self):
+        self.server.server_close()
+        assert not os.path.exists(self.socket_path)
+
+
+class TestCLIServerOptions(ServerBase):
+    app_cls = CLI2App
+
+    def test_command(self):
+        assert self.run('hello1') == (0, 'hello1\n', '')
+
+    def test_app_options(self):
+        self.run('is-quiet')
+        self.run('--quiet', 'is-quiet')
+        self.run('--quiet', 'is-quiet')
+        # one app per combination of app level options
+        assert len(self.server.apps) == 2
+
+    log_line = 'INFO - keg_apps.cli2.cli - logged foo\n'
+
+    def test_logging(self):
+        # the app's stream handler writes to the client of each command
+        for _ in range(2):
+            assert self.run('is-not-quiet') == (0, 'printed foo\n', self.log_line)
+
+    def test_logging_quiet(self):
+        assert self.run('is-not-quiet')[2] == self.log_line
+        assert self.run('--quiet', 'is-quiet')[2] == ''
+        # the quiet app's handlers don't stay in place
+        assert self.run('is-not-quiet')[2] == self.log_line
+        assert self.run('--quiet', 'is-quiet')[2] == ''
+
+    def test_stdin(self):
+        assert self.run('reverse', stdin='abc') == (0, 'Input: cba\n', '')
@@ -1,8 +1,11 @@
 import os
 from unittest import mock
 
+import appdirs
+import pytest
+
 from keg.app import Keg
-from keg.config import Config
+from keg.config import Config, ConfigurationError, substitute
 from keg.testing import cleanup_app_contexts, invoke_command
 from keg_apps.profile.cli import ProfileApp
 
@@ -90,6 +93,225 @@ class TestConfigDefaults(object):
         assert config['testvalue'] == '{not there}'
 
 
+class TestConfigSubstitution(object):
+
+    def init_config(self, **values):
+        config = Config('', {})
+        config.update(values)
+        config.init_app(None, 'fakeapp', '', False, app_instance_path='/fake/instance')
+        return config
+
+    def test_substitute_keys(self):
+        config = Config('', {'DEFAULT': substitute('{app_import_name}')})
+        assert config.substitute_keys == {'DEFAULT'}
+
+        config['FOO'] = substitute('{app_import_name}')
+        config.update(BAR=substitute('{app_import_name}'))
+        config.setdefault('BAZ', substitute('{app_import_name}'))
+        assert config.substitute_keys == {'DEFAULT', 'FOO', 'BAR', 'BAZ'}
+
+        config['FOO'] = 'foo'
+        del config['BAR']
+        config.pop('BAZ')
+        assert config.substitute_keys == {'DEFAULT'}
+
+    def test_apply(self):
+        with mock.patch.dict('os.environ', {'FAKEAPP_FOO': 'bar'}):
+            config = self.init_config(
+                NAME=substitute('{app_import_name}'),
+                INSTANCE=substitute('{instance_path}/foo'),
+                FROM_ENV=substitute('{env[FAKEAPP_FOO]}'),
+                LOG_DIR=substitute('{user_log_dir}'),
+            )
+        assert config['NAME'] == 'fakeapp'
+        assert config['INSTANCE'] == '/fake/instance/foo'
+        assert config['FROM_ENV'] == 'bar'
+        assert config['LOG_DIR'] == config.dirs.user_log_dir
+        assert not config.substitute_keys
+
+    def test_values_computed_lazily(self):
+        config = Config('', {})
+        config.dirs = mock.Mock()
+        config.app_import_name = 'fakeapp'
+        config['NAME'] = substitute('{app_import_name}')
+
+        sub_values = config.substitution_values()
+        config.substitution_apply(sub_values)
+        assert config['NAME'] == 'fakeapp'
+        assert list(sub_values.computed) == ['app_import_name']
+        assert not config.dirs.mock_calls
+
+    def test_unknown_value(self):
+        with pytest.raises(KeyError, match='not_there'):
+            self.init_config(FOO=substitute('{not_there}'))
+
+
+class TestConfigFreeze(object):
+
+    @pytest.fixture
+    def config(self):
+        config = Config('', {'FOO': 'bar', 'ENDPOINTS': {'home': 'public.home'}})
+        config.freeze()
+        return config
+
+    @pytest.mark.parametrize('mutate', [
+        lambda config: config.__setitem__('FOO', 'baz'),
+        lambda config: config.__delitem__('FOO'),
+        lambda config: config.update(FOO='baz'),
+        lambda config: config.setdefault('NEW', 'baz'),
+        lambda config: config.pop('FOO'),
+        lambda config: config.popitem(),
+        lambda config: config.clear(),
+        lambda config: config.from_mapping(FOO='baz'),
+    ])
+    def test_mutation_detected(self, config, mutate):
+        with pytest.raises(ConfigurationError, match='Config is frozen'):
+            mutate(config)
+        assert config['FOO'] == 'bar'
+
+    def test_values(self, config):
+        assert config.setdefault('FOO', 'baz') == 'bar'
+        with pytest.raises(TypeError):
+            config['ENDPOINTS']['home'] = 'foo'
+
+    def test_derived(self, config):
+        factory = mock.Mock(return_value='derived')
+        assert config.derived('foo', factory) == 'derived'
+        assert config.derived('foo', factory) == 'derived'
+        factory.assert_called_once_with(config)
+
+        # not cached while mutable
+        config.thaw()
+        config['FOO'] = 'baz'
+        config.derived('foo', factory)
+        config.derived('foo', factory)
+        assert factory.call_count == 3
+
+    def test_app_init(self):
+        app = Keg(__name__).init(config={'KEG_CONFIG_FREEZE': True})
+        assert app.config.frozen
+
+        assert not Keg(__name__).init().config.frozen
+
+
+class TestConfigFileDiscovery(object):
+
+    @pytest.fixture
+    def config(self, tmp_path):
+        (tmp_path / 'fakeapp-config.py').write_text('FOO = "bar"')
+        config = Config('', {})
+        config.app_import_name = 'fakeapp'
+        config.app_root_path = str(tmp_path / 'fakeapp')
+        config.dirs = appdirs.AppDirs('fakeapp', appauthor=False, multipath=True)
+        return config
+
+    def test_discover(self, config, tmp_path):
+        fpath = str(tmp_path / 'fakeapp-config.py')
+        missing_fpaths = config.config_file_paths()[:-1]
+        assert config.discover_config_files() == ([fpath], missing_fpaths)
+
+        # missing paths are cached, so only existing paths are checked again
+        with mock.patch('keg.config.os.stat') as m_stat:
+            assert config.discover_config_files() == ([fpath], missing_fpaths)
+        stat_paths = [call.args[0] for call in m_stat.call_args_list]
+        assert fpath in stat_paths
+        assert not set(stat_paths).intersection(missing_fpaths)
+
+    def test_duplicates(self, config, tmp_path):
+        fpath = str(tmp_path / 'fakeapp-config.py')
+        other_fpath = str(tmp_path / 'other' / 'fakeapp-config.py')
+        with mock.patch.object(config, 'config_file_paths',
+                               return_value=[fpath, other_fpath, fpath]):
+            assert config.discover_config_files() == ([fpath], [other_fpath])
+
+    def test_init_app(self, tmp_path):
+        (tmp_path / 'fakeapp-config.py').write_text('class SomeProfile:\n    FOO = "bar"\n')
+        config = Config('', {})
+        config.init_app('SomeProfile', 'fakeapp', str(tmp_path / 'fakeapp'), False)
+        assert config['FOO'] == 'bar'
+
+        unreadable_fpaths = [fpath for fpath, _ in config.config_paths_unreadable]
+        assert unreadable_fpaths == config.config_file_paths()[:-1]
+        assert all(isinstance(exc, FileNotFoundError)
+                   for _, exc in config.config_paths_unreadable)
+        assert [label for label, _ in config.timings] == [
+            'config file discovery', 'config files', 'config objects',
+        ]
+
+
+class TestConfigSnapshot(object):
+
+    @pytest.fixture
+    def app_root(self, tmp_path):
+        # config files are looked for in the app's parent directory
+        self.config_fpath = tmp_path / 'fakeapp-config.py'
+        self.write_config('one')
+        snapshot_fpath = str(tmp_path / 'snapshot.pickle')
+        with mock.patch.object(Config, 'snapshot_fpath', return_value=snapshot_fpath):
+            yield str(tmp_path / 'fakeapp')
+
+    def write_config(self, value, mtime_ns=1_000_000_000):
+        self.config_fpath.write_text('class SnapshotProfile:\n    SNAPSHOT = {!r}\n'.format(value))
+        os.utime(self.config_fpath, ns=(mtime_ns, mtime_ns))
+
+    def init_config(self, app_root, **kwargs):
+        config = Config('', {})
+        config.init_app('SnapshotProfile', 'fakeapp', app_root, False, snapshot=True, **kwargs)
+        return config
+
+    def test_loaded(self, app_root):
+        config = self.init_config(app_root)
+        assert not config.snapshot_loaded
+        assert config['SNAPSHOT'] == 'one'
+
+        with mock.patch('keg.config.pymodule_fpaths_to_objects') as m_fpaths:
+            config = self.init_config(app_root)
+        assert not m_fpaths.called
+        assert config.snapshot_loaded
+        assert config['SNAPSHOT'] == 'one'
+        assert config['KEG_ENDPOINTS']['home'] == 'public.home'
+        assert config.profile == 'SnapshotProfile'
+        assert config.configs_found == [
+            'keg.config.DefaultProfile',
+            '{}:SnapshotProfile'.format(self.config_fpath),
+        ]
+
+    def test_config_file_changed(self, app_root):
+        self.init_config(app_root)
+        self.write_config('two', mtime_ns=2_000_000_000)
+
+        config = self.init_config(app_root)
+        assert not config.snapshot_loaded
+        assert config['SNAPSHOT'] == 'two'
+
+    def test_environ_changed(self, app_root):
+        self.init_config(app_root)
+        with mock.patch.dict('os.environ', {'FAKEAPP_SOMETHING': 'foo'}):
+            assert not self.init_config(app_root).snapshot_loaded
+            assert self.init_config(app_root).snapshot_loaded
+
+    def test_not_used_with_config_file_objs(self, app_root):
+        self.init_config(app_root)
+        config = self.init_config(app_root, config_file_objs=[('/fake/path', {})])
+        assert not config.snapshot_loaded
+        assert 'SNAPSHOT' not in config
+
+    def test_environ_substitution(self, app_root):
+        self.config_fpath.write_text(
+            'from keg.config import substitute\n'
+            'class SnapshotProfile:\n'
+            '    SNAPSHOT = substitute("{env[HOME]}")\n'
+        )
+        # values from the environment aren't part of the snapshot's key
+        self.init_config(app_root)
+        assert not self.init_config(app_root).snapshot_loaded
+
+    def test_unpicklable_value(self, app_root):
+        self.config_fpath.write_text('class SnapshotProfile:\n    SNAPSHOT = lambda: None\n')
+        self.init_config(app_root)
+        assert not self.init_config(app_root).snapshot_loaded
+
+
 class TestProfileLoading(object):
 
     def test_app_init(self):
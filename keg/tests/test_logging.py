@@ -1,5 +1,6 @@
 from io import StringIO
 import logging
+from logging.handlers import SysLogHandler
 from unittest import mock
 
 from keg import signals
@@ -53,6 +54,19 @@ class TestLogging(object):
         log_record = args[0]
         assert log_record.message == 'test info log'
 
+    def test_reopen_syslog(self):
+        app = LoggingApp().init(use_test_profile=True, config={'KEG_LOG_SYSLOG_ENABLED': True})
+
+        def syslog_handlers():
+            return [handler for handler in app.logging.loggers[0].handlers
+                    if isinstance(handler, SysLogHandler)]
+
+        old_handler, = syslog_handlers()
+        app.logging.reopen_syslog()
+        new_handler, = syslog_handlers()
+        assert new_handler is not old_handler
+        assert new_handler.ident == old_handler.ident
+
 
 class TestJsonFormatter(object):
     def setup_method(self):
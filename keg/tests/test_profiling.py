@@ -0,0 +1,120 @@
+import logging
+import os
+
+import pytest
+
+from keg import signals
+from keg.app import Keg
+from keg.profiling import (
+    StartupProfile,
+    active_profile,
+    child_pids,
+    memory_usage,
+    send,
+    timed_import,
+)
+from keg_apps.web.app import WebApp
+
+
+class TestStartupProfile(object):
+
+    def test_app_init(self):
+        app = WebApp().init(use_test_profile=True)
+        profile = app.startup_profile
+
+        assert [name for name, _ in profile.phases] == [
+            'init_config', 'init_logging', 'init_error_handling', 'init_extensions',
+            'init_routes', 'init_blueprints', 'init_jinja', 'init_assets', 'init_visit_modules',
+            'on_init_complete', 'app_ready', 'init_complete',
+        ]
+        assert profile.total >= sum(seconds for _, seconds in profile.phases)
+
+        # the blog component's blueprint is imported when components are registered
+        assert 'keg_apps.web.blog.views' in dict(profile.imports)
+        receivers = [(signal_name, receiver_name)
+                     for signal_name, receiver_name, _ in profile.signals]
+        assert ('init-complete', 'keg.app.Keg.init_registered_components') in receivers
+
+        assert active_profile() is None
+
+    def test_signal_receivers(self):
+        calls = []
+        app = Keg(__name__)
+
+        @signals.config_complete.connect_via(app)
+        def on_config_complete(sender):
+            calls.append(sender)
+
+        app.init(use_test_profile=True)
+        assert calls == [app]
+        receiver_names = [receiver_name for _, receiver_name, _ in app.startup_profile.signals]
+        assert (
+            'keg.tests.test_profiling.TestStartupProfile.test_signal_receivers.'
+            '<locals>.on_config_complete'
+        ) in receiver_names
+
+    def test_not_active(self):
+        # outside of app init, imports & signals are not recorded and work as usual
+        with timed_import('foo'):
+            pass
+        app = Keg(__name__)
+        assert send(signals.app_ready, app) == []
+
+    def test_receiver_error(self):
+        profile = StartupProfile()
+        app = Keg(__name__)
+
+        @signals.app_ready.connect_via(app)
+        def on_app_ready(sender):
+            raise ValueError('boom')
+
+        with profile.activate():
+            with pytest.raises(ValueError, match='boom'):
+                send(signals.app_ready, app)
+        assert [signal_name for signal_name, _, _ in profile.signals] == ['app-ready']
+
+    def test_report(self):
+        profile = StartupProfile()
+        profile.phases = [('init_config', 0.002), ('init_logging', 0.001)]
+        profile.total = 0.003
+        profile.imports = [('fast', 0.001), ('slow', 0.01)]
+        profile.signals = [('init-complete', 'foo.receiver', 0.0005)]
+        assert profile.report() == [
+            'Phases:',
+            '    init_config: 2.0ms',
+            '    init_logging: 1.0ms',
+            '    total: 3.0ms',
+            'Imports:',
+            '    slow: 10.0ms',
+            '    fast: 1.0ms',
+            'Signal receivers:',
+            '    init-complete -> foo.receiver: 0.5ms',
+        ]
+
+    def test_log_record(self, caplog):
+        with caplog.at_level(logging.INFO):
+            app = Keg(__name__).init(use_test_profile=True,
+                                     config={'KEG_STARTUP_PROFILE_LOG': True})
+        record, = [record for record in caplog.records
+                   if record.getMessage().startswith('App initialized in ')]
+        assert record.startup_profile == app.startup_profile.as_dict()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/smaps_rollup'), reason='needs smaps_rollup')
+class TestMemoryUsage(object):
+
+    def test_current_process(self):
+        usage = memory_usage()
+        assert usage['Rss'] > 0
+        assert usage['Shared'] == usage['Shared_Clean'] + usage['Shared_Dirty']
+        assert usage['Private'] == usage['Private_Clean'] + usage['Private_Dirty']
+        assert usage['Rss'] == usage['Shared'] + usage['Private']
+
+    def test_child_pids(self):
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        try:
+            assert pid in child_pids(os.getpid())
+        finally:
+            os.waitpid(pid, 0)
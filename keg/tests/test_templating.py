@@ -1,5 +1,6 @@
 import os
 
+import flask
 from jinja2 import TemplateSyntaxError
 import pytest
 
@@ -48,6 +49,15 @@ class TestAssetsInclude(object):
         )
         assert content.strip() == '/* assets_in_template css file */'
 
+    def test_assets_created_lazily(self, app):
+        with app.test_request_context() as ctx:
+            assert ctx._assets is None
+            assert flask.render_template_string('no assets here') == 'no assets here'
+            assert ctx._assets is None
+
+            self.render('assets_in_template.html')
+            assert len(ctx._assets.content['js']) == 1
+
     def test_include_with_params(self):
         with pytest.raises(TemplateSyntaxError) as e:
             self.render('assets_with_params.html')
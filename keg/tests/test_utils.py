@@ -1,11 +1,23 @@
+import importlib.util
+import os
+import sys
 import tempfile
 from unittest import mock
 
 import flask
 import pytest
 
+from keg.profiling import StartupProfile
 from keg.testing import ContextManager, inrequest
-from keg.utils import pymodule_fpaths_to_objects
+from keg.utils import (
+    ArgumentValidationError,
+    compile_binder,
+    dependency_batches,
+    dependency_order,
+    prefetch_modules,
+    pymodule_fpaths_to_objects,
+    validate_arguments,
+)
 from keg_apps.web.app import WebApp
 
 
@@ -48,6 +60,163 @@ class TestUtils(object):
         assert isinstance(exc, error)
 
 
+class TestCompileCached(object):
+
+    @pytest.fixture
+    def fpath(self, tmp_path):
+        fpath = tmp_path / 'app-config.py'
+        fpath.write_text('foo = "bar"')
+        # the test environment may have PYTHONDONTWRITEBYTECODE set
+        with mock.patch.object(sys, 'dont_write_bytecode', False):
+            yield str(fpath)
+
+    def objects(self, fpath):
+        (_, objects, exc), = pymodule_fpaths_to_objects([fpath])
+        assert exc is None
+        return objects
+
+    def test_cached(self, fpath):
+        with mock.patch('keg.utils.compile', wraps=compile, create=True) as m_compile:
+            assert self.objects(fpath)['foo'] == 'bar'
+            assert self.objects(fpath)['foo'] == 'bar'
+        assert m_compile.call_count == 1
+        assert os.path.exists(importlib.util.cache_from_source(fpath))
+
+    def test_source_changed(self, fpath):
+        assert self.objects(fpath)['foo'] == 'bar'
+        with open(fpath, 'w') as fo:
+            fo.write('foo = "baz!"')
+        assert self.objects(fpath)['foo'] == 'baz!'
+
+    def test_invalid_cache(self, fpath):
+        self.objects(fpath)
+        with open(importlib.util.cache_from_source(fpath), 'r+b') as fo:
+            fo.seek(16)
+            fo.write(b'garbage')
+        with mock.patch('keg.utils.compile', wraps=compile, create=True) as m_compile:
+            assert self.objects(fpath)['foo'] == 'bar'
+        assert m_compile.call_count == 1
+
+    @mock.patch.object(sys, 'dont_write_bytecode', True)
+    def test_dont_write_bytecode(self, fpath):
+        assert self.objects(fpath)['foo'] == 'bar'
+        assert not os.path.exists(importlib.util.cache_from_source(fpath))
+
+
+class TestDependencyBatches:
+    def test_batches(self):
+        batches = dependency_batches({
+            'c': ['a', 'b'],
+            'b': ['a', 'not-a-node'],
+            'a': [],
+            'd': [],
+        })
+        assert batches == [['a', 'd'], ['b'], ['c']]
+
+    def test_self_dependency_ignored(self):
+        assert dependency_batches({'a': ['a']}) == [['a']]
+
+    def test_circular(self):
+        with pytest.raises(ValueError, match='Circular dependency between: a, b'):
+            dependency_batches({'a': ['b'], 'b': ['a'], 'c': []})
+
+
+class TestDependencyOrder:
+    def test_order(self):
+        order = dependency_order({
+            'd': [],
+            'c': ['b', 'a'],
+            'a': ['not-a-node'],
+            'b': ['a'],
+            'e': [],
+        })
+        # c is preceded by what it depends on, in their given order, the others keep their place
+        assert order == ['d', 'a', 'b', 'c', 'e']
+
+    def test_self_dependency_ignored(self):
+        assert dependency_order({'a': ['a']}) == ['a']
+
+    def test_circular(self):
+        with pytest.raises(ValueError, match='Circular dependency between: a, b'):
+            dependency_order({'c': [], 'a': ['b'], 'b': ['a']})
+
+
+class TestPrefetchModules:
+
+    def test_prefetch(self):
+        sys.modules.pop('keg_apps.web.news.views', None)
+        profile = StartupProfile()
+        with profile.activate():
+            prefetch_modules(['keg_apps.web.news.views', 'keg_apps.not_there'], 2)
+
+        assert 'keg_apps.web.news.views' in sys.modules
+        # recorded from the worker threads, even for the import that failed
+        assert sorted(path for path, _ in profile.imports) == [
+            'keg_apps.not_there', 'keg_apps.web.news.views',
+        ]
+
+
+class TestValidateArguments:
+    def test_positional_and_defaults(self):
+        def func(a, b, c=3):
+            pass
+
+        assert validate_arguments(func, (1,), {'b': 2, 'd': 4}) == ((1, 2, 3), {})
+        assert validate_arguments(func, (), {'a': 1, 'b': 2, 'c': 5}) == ((1, 2, 5), {})
+
+    def test_kwargs_not_modified(self):
+        def func(a, b):
+            pass
+
+        kwargs = {'b': 2, 'd': 4}
+        validate_arguments(func, (1,), kwargs)
+        assert kwargs == {'b': 2, 'd': 4}
+
+    def test_keyword_only(self):
+        def func(a, *, b, c=3):
+            pass
+
+        assert validate_arguments(func, (1,), {'b': 2, 'd': 4}) == ((1,), {'b': 2})
+
+        with pytest.raises(ArgumentValidationError) as excinfo:
+            validate_arguments(func, (1,), {})
+        assert excinfo.value.missing == {'b'}
+
+    def test_var_args(self):
+        def func(a, *args, **kwargs):
+            pass
+
+        assert validate_arguments(func, (1, 2), {'a': 5, 'b': 3}) == ((1, 2), {'b': 3})
+
+    def test_missing(self):
+        def func(a, b):
+            pass
+
+        with pytest.raises(ArgumentValidationError) as excinfo:
+            validate_arguments(func, (), {'a': 1})
+        assert excinfo.value.missing == {'b'}
+
+    def test_extra_not_dropped(self):
+        def func(a):
+            pass
+
+        with pytest.raises(ArgumentValidationError) as excinfo:
+            validate_arguments(func, (1, 2), {'a': 3, 'b': 4}, drop_extra=False)
+        assert excinfo.value.extra == {'a': 3, 'b': 4}
+        assert excinfo.value.extra_positional == (2,)
+
+        assert validate_arguments(func, (1,), {}, drop_extra=False) == ((1,), {})
+
+    def test_bound_method(self):
+        class Thing:
+            def method(self, a):
+                pass
+
+        thing = Thing()
+        assert validate_arguments(thing.method, (thing,), {'a': 1}) == ((thing, 1), {})
+        assert compile_binder(thing.method) is compile_binder(Thing.method)
+
+
 class TestInRequest:
     @classmethod
     def setup_class(cls):
@@ -1,3 +1,7 @@
+import gc
+from unittest import mock
+import weakref
+
 from keg.testing import WebBase
 
 from keg_apps.web.app import WebApp
@@ -14,6 +18,38 @@ class TestViewTemplating(WebBase):
         resp = self.testapp.get('/template2')
         assert resp.text == 'template-too'
 
+    def test_template_resolution_cached(self):
+        self.testapp.get('/template1')
+
+        jinja_env = self.app.jinja_env
+        with mock.patch.object(jinja_env, 'get_template', wraps=jinja_env.get_template) as m_get:
+            resp = self.testapp.get('/template1')
+        assert resp.text == 'Hello world!'
+        m_get.assert_not_called()
+
+    def test_template_cache_reloads(self):
+        from keg_apps.web.views.templating import Template1
+        self.testapp.get('/template1')
+
+        with self.app.test_request_context('/template1'):
+            view = Template1()
+            template = view.cached_template()
+            assert template.name == 'templating/template1.html'
+            with mock.patch.object(self.app.jinja_env, 'auto_reload', True), \
+                    mock.patch.object(type(template), 'is_up_to_date', False):
+                assert view.cached_template() is None
+
+    def test_template_cache_per_app(self):
+        app = WebApp().init(use_test_profile=True)
+        assert app.test_client().get('/template1').text == 'Hello world!'
+        assert len(app.view_template_cache) == 1
+
+        # the cached templates don't keep the app alive
+        app_ref = weakref.ref(app)
+        del app
+        gc.collect()
+        assert app_ref() is None
+
 
 class TestJinjaInit(WebBase):
     appcls = WebApp
@@ -1,6 +1,12 @@
+from unittest import mock
+
 import flask
+import pytest
+from werkzeug.routing import BuildError
+
 from keg.component import KegComponent
 from keg.testing import WebBase
+from keg.web import BaseView, ImmediateResponse, LoaderDependencyError, redirect
 
 from keg_apps.web.app import WebApp
 
@@ -38,6 +44,133 @@ class TestBaseViewFeatures(WebBase):
         resp = self.testapp.get('/response-middleware/baz')
         assert resp.body == b''
 
+    def test_dispatch_hooks(self):
+        resp = self.testapp.get('/dispatch-hooks/foo')
+        assert resp.text == 'pre_auth:foo,pre_loaders,pre_method:foo,get'
+
+    def test_dispatch_plan_hooks(self):
+        from keg_apps.web.views.other import DispatchHooks, ResponseMiddleware
+
+        plan = DispatchHooks.dispatch_plan()
+        assert sorted(plan.hooks) == ['check_auth', 'pre_auth', 'pre_loaders', 'pre_method']
+        assert plan.pre_render is None
+        assert plan.pre_response is None
+
+        plan = ResponseMiddleware.dispatch_plan()
+        assert sorted(plan.hooks) == ['check_auth', 'pre_response']
+        # plans are compiled per class when routes are set up
+        assert ResponseMiddleware.__dict__['_dispatch_plan'] is plan
+
+    def test_expected_qs_args(self):
+        resp = self.testapp.get('/query-args?color=red&other=foo')
+        assert resp.text == 'red None'
+
+        resp = self.testapp.get('/query-args?size=1&size=2')
+        assert resp.text == "None ['1', '2']"
+
+        # URL arguments take precedence over query string arguments
+        resp = self.testapp.get('/query-args/blue?color=red&size=3')
+        assert resp.text == 'blue 3'
+
+    def test_loaders(self):
+        resp = self.testapp.get('/loaders/3')
+        assert resp.text == '3 owner3 audited owner3'
+
+        self.testapp.get('/loaders/0', status=404)
+
+    def test_loader_batches(self):
+        from keg_apps.web.views.other import Loaders
+
+        batches = Loaders.dispatch_plan().loader_batches
+        assert [[arg_key for arg_key, _ in batch] for batch in batches] == [
+            ['record'], ['owner'], ['audit'],
+        ]
+
+    def test_concurrent_loaders(self):
+        resp = self.testapp.get('/concurrent-loaders/foo')
+        assert resp.text == '/concurrent-loaders/foo FOO hello foo'
+
+    def test_concurrent_sync_loaders(self):
+        resp = self.testapp.get('/concurrent-sync-loaders/foo')
+        assert resp.text == '/concurrent-sync-loaders/foo FOO'
+
+        with pytest.raises(ValueError, match='deliberate loader error'):
+            self.testapp.get('/concurrent-sync-loaders/error')
+
+    def test_async_loader(self):
+        resp = self.testapp.get('/async-loader/foo')
+        assert resp.text == 'hello foo'
+
+        self.testapp.get('/async-loader/missing', status=404)
+
+    def test_async_view(self):
+        resp = self.testapp.get('/async-view/foo')
+        assert resp.text == 'hello foo'
+
+        resp = self.testapp.get('/async-view/render')
+        assert resp.body.splitlines()[0] == b'bar = hello render'
+
+        resp = self.testapp.get('/async-view/swap')
+        assert resp.text == 'swapped'
+
+    def test_async_dispatch_plan(self):
+        from keg_apps.web.views.other import AsyncLoader, AsyncView, Loaders
+
+        assert AsyncView.dispatch_plan().is_async
+        assert AsyncLoader.dispatch_plan().is_async
+        assert not Loaders.dispatch_plan().is_async
+
+    def test_loader_circular_dependency(self):
+        with pytest.raises(LoaderDependencyError, match='Loaders of Circular can not be ordered'):
+            class Circular(BaseView):
+                def foo_loader(self, bar):
+                    pass
+
+                def bar_loader(self, foo):
+                    pass
+
+            Circular.dispatch_plan()
+
+
+class TestRedirect(object):
+
+    @pytest.fixture
+    def app(self):
+        return WebApp.testing_prep()
+
+    def redirect_location(self, app, endpoint):
+        with app.test_request_context():
+            with pytest.raises(ImmediateResponse) as exc_info:
+                redirect(endpoint)
+        return exc_info.value.response.location
+
+    def test_keg_endpoints(self, app):
+        endpoints = {'home': 'other.blank-view', 'Mixed': 'other.blank-view'}
+        with mock.patch.dict(app.config, KEG_ENDPOINTS=endpoints):
+            assert self.redirect_location(app, 'HOME') == '/blank-view'
+            assert self.redirect_location(app, 'other.auto-assign') == '/auto-assign'
+            # only lowercase keys can be used, by their uppercase name
+            with pytest.raises(BuildError):
+                self.redirect_location(app, 'MIXED')
+
+    def test_mutable_config(self, app):
+        endpoints = {'home': 'other.blank-view'}
+        with mock.patch.dict(app.config, KEG_ENDPOINTS=endpoints):
+            with mock.patch('keg.web._redirect_endpoints') as m_redirect_endpoints:
+                assert self.redirect_location(app, 'HOME') == '/blank-view'
+            # nothing is derived from a config that can change
+            m_redirect_endpoints.assert_not_called()
+
+    def test_frozen_config(self, app):
+        endpoints = {'home': 'other.blank-view'}
+        with mock.patch.dict(app.config, KEG_ENDPOINTS=endpoints):
+            app.config.freeze()
+            try:
+                assert self.redirect_location(app, 'HOME') == '/blank-view'
+                assert 'keg.web.redirect' in app.config._derived
+            finally:
+                app.config.thaw()
+
 
 class TestBlueprintUsage(WebBase):
     appcls = WebApp
@@ -1,5 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import importlib.util
 import inspect
+import marshal
 import os
+import struct
+import sys
+import tempfile
+import types
 import weakref
 
 import flask
@@ -7,8 +15,9 @@ import pathlib
 from werkzeug.utils import import_string
 
 from keg.extensions import lazy_gettext as _
+from keg.profiling import timed_import
 
-_signature_cache = weakref.WeakKeyDictionary()
+_binder_cache = weakref.WeakKeyDictionary()
 
 
 # sentinal object
@@ -94,6 +103,67 @@ class HybridMethod(object):
 hybridmethod = HybridMethod
 
 
+def write_atomic(fpath, data, mode=None):
+    """
+        Write `data` (str or bytes) to `fpath` through a temporary file in the same directory that
+        is then renamed, so other processes never see a partially written file.
+    """
+    dpath = os.path.dirname(fpath)
+    fd, tmp_fpath = tempfile.mkstemp(dir=dpath or None,
+                                     prefix='.{}.'.format(os.path.basename(fpath)))
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as fo:
+            fo.write(data)
+        if mode is not None:
+            os.chmod(tmp_fpath, mode)
+        os.replace(tmp_fpath, fpath)
+    except BaseException:
+        os.unlink(tmp_fpath)
+        raise
+
+
+def compile_cached(fpath, fo):
+    """
+        Compile the python source in the open file `fo`, caching the code object in a
+        ``__pycache__`` .pyc file the same way Python does when importing a module.  The cache is
+        validated by the source's mtime and size.
+    """
+    stat = os.fstat(fo.fileno())
+    # PEP 552 header for a timestamp based pyc
+    header = importlib.util.MAGIC_NUMBER + struct.pack(
+        '<III', 0, int(stat.st_mtime) & 0xFFFFFFFF, stat.st_size & 0xFFFFFFFF
+    )
+    try:
+        cache_fpath = importlib.util.cache_from_source(fpath)
+    except NotImplementedError:
+        # the python implementation doesn't cache bytecode
+        cache_fpath = None
+
+    if cache_fpath is not None:
+        try:
+            with open(cache_fpath, 'rb') as cache_fo:
+                data = cache_fo.read()
+            if data[:16] == header:
+                code = marshal.loads(data[16:])
+                if isinstance(code, types.CodeType):
+                    return code
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+    code = compile(fo.read(), fpath, 'exec')
+
+    if cache_fpath is not None and not sys.dont_write_bytecode:
+        try:
+            os.makedirs(os.path.dirname(cache_fpath), exist_ok=True)
+            # like Python, the cache is readable by whoever can read the source
+            write_atomic(cache_fpath, header + marshal.dumps(code),
+                         mode=(stat.st_mode | 0o200) & 0o666)
+        except OSError:
+            # e.g. a config file in a directory we can't write to, just don't cache it
+            pass
+    return code
+
+
 def pymodule_fpaths_to_objects(fpaths):
     """
         Takes an iterable of file paths reprenting possible python modules and will return an
@@ -108,7 +178,7 @@ def pymodule_fpaths_to_objects(fpaths):
         try:
             pymodule_globals = {}
             with open(fpath) as fo:
-                exec(compile(fo.read(), fpath, 'exec'), pymodule_globals)
+                exec(compile_cached(fpath, fo), pymodule_globals)
             retval.append((fpath, pymodule_globals, None))
         except (FileNotFoundError, IsADirectoryError, PermissionError) as exc:
             retval.append((fpath, None, exc))
@@ -128,7 +198,84 @@ def visit_modules(dotted_paths, base_path=None):
     for path in dotted_paths:
         if path.startswith('.') and base_path is not None:
             path = base_path + path
-        import_string(path)
+        with timed_import(path):
+            import_string(path)
+
+
+def prefetch_modules(dotted_paths, max_workers):
+    """
+        Import modules concurrently, so the time spent reading, unmarshalling and executing them
+        overlaps.  Errors are ignored: they will be raised again, in a predictable order, when the
+        caller imports the modules for real.
+    """
+    def prefetch(path):
+        with timed_import(path):
+            importlib.import_module(path)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='keg-prefetch') as pool:
+        for path in dotted_paths:
+            # each task needs its own copy of the context, which holds the active startup profile
+            pool.submit(contextvars.copy_context().run, prefetch, path)
+
+
+def dependency_batches(dependencies):
+    """
+        Group names into batches such that every name only depends on names in earlier batches.
+
+        `dependencies` maps each name to an iterable of names it depends on.  Dependencies that
+        are not themselves keys of `dependencies` are ignored.  Names within a batch are sorted,
+        so the result is deterministic.  Raises `ValueError` if the dependencies are circular.
+    """
+    remaining = {
+        name: set(deps).intersection(dependencies).difference((name,))
+        for name, deps in dependencies.items()
+    }
+    batches = []
+    while remaining:
+        batch = sorted(name for name, deps in remaining.items() if not deps)
+        if not batch:
+            raise ValueError(_('Circular dependency between: {names}',
+                               names=', '.join(sorted(remaining))))
+        for name in batch:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(batch)
+        batches.append(batch)
+    return batches
+
+
+def dependency_order(dependencies):
+    """
+        The names of `dependencies` in their given order, except that a name is moved after the
+        names it depends on.
+
+        `dependencies` maps each name to an iterable of names it depends on.  Dependencies that
+        are not themselves keys of `dependencies` are ignored.  Raises `ValueError` if the
+        dependencies are circular.
+    """
+    position = {name: idx for idx, name in enumerate(dependencies)}
+    order = []
+    done = set()
+    visiting = []
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            cycle = visiting[visiting.index(name):]
+            raise ValueError(_('Circular dependency between: {names}',
+                               names=', '.join(sorted(cycle))))
+        visiting.append(name)
+        deps = set(dependencies[name]).intersection(position).difference((name,))
+        for dep in sorted(deps, key=position.get):
+            visit(dep)
+        visiting.pop()
+        done.add(name)
+        order.append(name)
+
+    for name in dependencies:
+        visit(name)
+    return order
 
 
 def validate_arguments(func, args, kwargs, drop_extra=True):  # type: ignore
@@ -155,7 +302,7 @@ def validate_arguments(func, args, kwargs, drop_extra=True):  # type: ignore
     This can be useful for decorators that forward user submitted data to
     a view function::
 
-        from werkzeug.utils import ArgumentValidationError, validate_arguments
+        from keg.utils import ArgumentValidationError, validate_arguments
 
         def sanitize(f):
             def proxy(request):
@@ -170,110 +317,130 @@ def validate_arguments(func, args, kwargs, drop_extra=True):  # type: ignore
 
     :param func: the function the validation is performed against.
     :param args: a tuple of positional arguments.
-    :param kwargs: a dict of keyword arguments.
+    :param kwargs: a dict of keyword arguments.  It is not modified.
     :param drop_extra: set to `False` if you don't want extra arguments
                        to be silently dropped.
     :return: tuple in the form ``(args, kwargs)``.
 
-    .. deprecated:: 2.0
-        Will be removed in Werkzeug 2.1. Use :func:`inspect.signature`
-        instead.
-
-    Copied from Werkzeug
+    Originally copied from Werkzeug, now backed by `compile_binder`.
     """
-    parser = _parse_signature(func)
-    args, kwargs, missing, extra, extra_positional = parser(args, kwargs)[:5]
-    if missing:
-        raise ArgumentValidationError(tuple(missing))
-    elif (extra or extra_positional) and not drop_extra:
-        raise ArgumentValidationError(None, extra, extra_positional)
-    return tuple(args), kwargs
+    return compile_binder(func).bind(args, kwargs, drop_extra=drop_extra)
 
 
-def _parse_signature(func):  # type: ignore
-    """Return a signature object for the function.
+def compile_binder(func):
+    """
+        Return the `SignatureBinder` for `func`, inspecting its signature only the first time a
+        given function is seen.  Bound methods share the binder of their underlying function.
+    """
+    key = getattr(func, '__func__', func)
+    try:
+        binder = _binder_cache.get(key)
+    except TypeError:
+        # not weak-referenceable, so can't be cached
+        return SignatureBinder(func)
+    if binder is None:
+        binder = _binder_cache[key] = SignatureBinder(func)
+    return binder
+
+
+class SignatureBinder(object):
+    """
+        Binds positional and keyword arguments to the signature of a function, keeping only the
+        arguments the function accepts.  The signature is broken down once into the lookups
+        `bind` needs, so binding doesn't have to walk the parameters or copy the keyword args.
 
-    .. deprecated:: 2.0
-        Will be removed in Werkzeug 2.1 along with ``utils.bind`` and
-        ``validate_arguments``.
+        As with `inspect.getfullargspec`, the first parameter of a bound method is included (i.e.
+        `self` must be given), and wrapped functions are not unwrapped.
     """
-    # if we have a cached validator for this function, return it
-    parse = _signature_cache.get(func)
-    if parse is not None:
-        return parse
-
-    # inspect the function signature and collect all the information
-    tup = inspect.getfullargspec(func)
-    positional, vararg_var, kwarg_var, defaults = tup[:4]
-    defaults = defaults or ()
-    arg_count = len(positional)
-    arguments = []
-    for idx, name in enumerate(positional):
-        if isinstance(name, list):
-            raise TypeError(
-                "cannot parse functions that unpack tuples in the function signature"
-            )
-        try:
-            default = defaults[idx - arg_count]
-        except IndexError:
-            param = (name, False, None)
-        else:
-            param = (name, True, default)
-        arguments.append(param)
-    arguments = tuple(arguments)
+    empty = inspect.Parameter.empty
+
+    def __init__(self, func):
+        func = getattr(func, '__func__', func)
+        params = inspect.signature(func, follow_wrapped=False).parameters.values()
+
+        positional = []
+        kwonly = []
+        self.var_positional = False
+        self.var_keyword = False
+        for param in params:
+            if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+                positional.append((param.name, param.default))
+            elif param.kind == param.KEYWORD_ONLY:
+                kwonly.append((param.name, param.default))
+            elif param.kind == param.VAR_POSITIONAL:
+                self.var_positional = True
+            else:
+                self.var_keyword = True
+
+        self.positional = tuple(positional)
+        self.positional_names = tuple(name for name, default in positional)
+        self.kwonly = tuple(kwonly)
+        self.arg_count = len(positional)
+        self.accepted_names = frozenset(self.positional_names).union(
+            name for name, default in kwonly
+        )
 
-    def parse(args, kwargs):  # type: ignore
-        new_args = []
+    def bind(self, args, kwargs, drop_extra=True):
+        """
+            Returns ``(args, kwargs)`` that can be passed to the function.  Raises
+            `ArgumentValidationError` if arguments are missing, or, when `drop_extra` is false, if
+            arguments were given that the function can't accept.
+        """
+        empty = self.empty
+        arg_count = self.arg_count
+        given_count = len(args)
         missing = []
-        extra = {}
 
-        # consume as many arguments as positional as possible
-        for idx, (name, has_default, default) in enumerate(arguments):
-            try:
-                new_args.append(args[idx])
-            except IndexError:
-                try:
-                    new_args.append(kwargs.pop(name))
-                except KeyError:
-                    if has_default:
-                        new_args.append(default)
-                    else:
-                        missing.append(name)
+        if given_count <= arg_count or self.var_positional:
+            new_args = list(args)
+        else:
+            new_args = list(args[:arg_count])
+        for name, default in self.positional[given_count:]:
+            if name in kwargs:
+                new_args.append(kwargs[name])
+            elif default is not empty:
+                new_args.append(default)
             else:
-                if name in kwargs:
-                    extra[name] = kwargs.pop(name)
-
-        # handle extra arguments
-        extra_positional = args[arg_count:]
-        if vararg_var is not None:
-            new_args.extend(extra_positional)
-            extra_positional = ()
-        if kwargs and kwarg_var is None:
-            extra.update(kwargs)
-            kwargs = {}
-
-        return (
-            new_args,
-            kwargs,
-            missing,
-            extra,
-            extra_positional,
-            arguments,
-            vararg_var,
-            kwarg_var,
-        )
+                missing.append(name)
+
+        new_kwargs = {}
+        for name, default in self.kwonly:
+            if name in kwargs:
+                new_kwargs[name] = kwargs[name]
+            elif default is empty:
+                missing.append(name)
+
+        if missing:
+            raise ArgumentValidationError(tuple(missing))
+
+        if self.var_keyword:
+            # everything that didn't bind to a positional arg goes through to **kwargs
+            new_kwargs.update(
+                (key, value) for key, value in kwargs.items() if key not in self.positional_names
+            )
 
-    _signature_cache[func] = parse
-    return parse
+        if not drop_extra:
+            self.check_extra(args, kwargs)
 
+        return tuple(new_args), new_kwargs
 
-class ArgumentValidationError(ValueError):
-    """Raised if :func:`validate_arguments` fails to validate
+    def check_extra(self, args, kwargs):
+        # positional args also given by keyword
+        extra = {
+            name: kwargs[name]
+            for name in self.positional_names[:len(args)] if name in kwargs
+        }
+        if not self.var_keyword:
+            extra.update(
+                (key, value) for key, value in kwargs.items() if key not in self.accepted_names
+            )
+        extra_positional = () if self.var_positional else args[self.arg_count:]
+        if extra or extra_positional:
+            raise ArgumentValidationError(None, extra, extra_positional)
 
-    .. deprecated:: 2.0
-        Will be removed in Werkzeug 2.1 along with ``utils.bind`` and
-        ``validate_arguments``.
-    """
+
+class ArgumentValidationError(ValueError):
+    """Raised if :func:`validate_arguments` fails to validate"""
 
     def __init__(self, missing=None, extra=None, extra_positional=None):  # type: ignore
         self.missing = set(missing or ())
@@ -1,5 +1,9 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+import contextvars
 import inspect
 import sys
+import threading
 from warnings import warn
 
 from blazeutils.strings import case_cw2us, case_cw2dash
@@ -11,10 +15,14 @@ try:
 except ImportError:
     MethodViewType = None
 from jinja2 import TemplateNotFound
-from werkzeug.datastructures import MultiDict
 
 from keg.extensions import lazy_gettext as _
-from keg.utils import validate_arguments, ArgumentValidationError
+from keg.utils import (
+    ArgumentValidationError,
+    compile_binder,
+    dependency_batches,
+    validate_arguments,
+)
 
 
 class ImmediateResponse(Exception):
@@ -31,9 +39,22 @@ def flash_abort(message):
     raise ImmediateResponse
 
 
+def _redirect_endpoints(config):
+    """ Maps the uppercased KEG_ENDPOINTS keys usable with redirect() to their endpoints. """
+    return {
+        key.upper(): endpoint for key, endpoint in config['KEG_ENDPOINTS'].items()
+        if key.upper().lower() == key
+    }
+
+
 def redirect(endpoint, *args, **kwargs):
-    if endpoint.upper() == endpoint:
-        keg_endpoints = flask.current_app.config['KEG_ENDPOINTS']
+    config = flask.current_app.config
+    if config.frozen:
+        keg_endpoints = config.derived('keg.web.redirect', _redirect_endpoints)
+        endpoint = keg_endpoints.get(endpoint, endpoint)
+    elif endpoint.upper() == endpoint:
+        # derived() isn't cached while the config can change, look the endpoint up directly
+        keg_endpoints = config['KEG_ENDPOINTS']
         if endpoint.lower() in keg_endpoints:
             endpoint = keg_endpoints[endpoint.lower()]
 
@@ -45,18 +66,8 @@ class ViewArgumentError(Exception):
     pass
 
 
-def _werkzeug_multi_dict_conv(md):
-    '''
-        Werzeug Multi-Dicts are either flat or lists, but we want a single value
-        if only one value or a list if multiple values
-    '''
-    retval = {}
-    for key, value in md.to_dict(flat=False).items():
-        if len(value) == 1:
-            retval[key] = value[0]
-        else:
-            retval[key] = value
-    return retval
+class LoaderDependencyError(ViewArgumentError):
+    pass
 
 
 def _call_with_expected_args(view, calling_args, method, method_is_bound=True):
@@ -71,20 +82,184 @@ def _call_with_expected_args(view, calling_args, method, method_is_bound=True):
         # so we need to "trick" it by sending self here, but then
         # removing it before the bound method is called below
         pos_args = (view,) if method_is_bound else tuple()
-        args, kwargs = validate_arguments(method, pos_args, calling_args.copy())
+        args, kwargs = validate_arguments(method, pos_args, calling_args)
     except ArgumentValidationError as e:
-        msg = _('Argument mismatch occured: method={method}, missing={missing}, '
-                'extra_keys={extra_keys}, extra_pos={extra_pos}.'
-                '  Arguments available: {calling_args}',
-                method=method, missing=e.missing, extra_keys=e.extra,
-                extra_pos=e.extra_positional, calling_args=calling_args)
-        raise ViewArgumentError(msg)
+        raise _argument_mismatch(method, e, calling_args)
     if method_is_bound:
         # remove "self" from args since its a bound method
         args = args[1:]
     return method(*args, **kwargs)
 
 
+def _argument_mismatch(method, exc, calling_args):
+    msg = _('Argument mismatch occured: method={method}, missing={missing}, '
+            'extra_keys={extra_keys}, extra_pos={extra_pos}.'
+            '  Arguments available: {calling_args}',
+            method=method, missing=exc.missing, extra_keys=exc.extra,
+            extra_pos=exc.extra_positional, calling_args=calling_args)
+    return ViewArgumentError(msg)
+
+
+class ViewStep(object):
+    """
+        A view method resolved once per view class, along with the binder for its signature.
+        Calling the step with a view instance and the calling args runs the method the same way
+        `_call_with_expected_args` would, minus the attribute probing.
+    """
+
+    def __init__(self, func):
+        # func is the plain function from the class, so the view instance is passed explicitly
+        # as the first positional argument.
+        self.func = func
+        self.binder = compile_binder(func)
+        self.is_async = inspect.iscoroutinefunction(func)
+
+    def bind(self, view, calling_args):
+        try:
+            return self.binder.bind((view,), calling_args)
+        except ArgumentValidationError as e:
+            raise _argument_mismatch(self.func, e, calling_args)
+
+    def __call__(self, view, calling_args):
+        args, kwargs = self.bind(view, calling_args)
+        return self.func(*args, **kwargs)
+
+
+async def _await_step(step, view, calling_args):
+    retval = step(view, calling_args)
+    if inspect.isawaitable(retval):
+        retval = await retval
+    return retval
+
+
+class DispatchPlan(object):
+    """
+        The dispatch steps that actually exist on a view class, compiled once so that
+        `BaseView.dispatch_request` does not have to probe the view for each hook on every
+        request.
+
+        Hooks that are not plain functions on the class (e.g. assigned on the instance) are not
+        precompiled and will be looked up for each request instead.
+    """
+    hook_names = ('pre_auth', 'check_auth', 'pre_loaders', 'pre_method', 'pre_render',
+                  'pre_response')
+
+    def __init__(self, view_cls):
+        self.view_cls = view_cls
+        self.hooks = {}
+        for name in self.hook_names:
+            step = self.compile_step(name)
+            if step is not None:
+                self.hooks[name] = step
+
+        # steps run before loaders, in lifecycle order
+        self.before_loaders = [
+            self.hooks[name] for name in ('pre_auth', 'check_auth', 'pre_loaders')
+            if name in self.hooks
+        ]
+        self.pre_method = self.hooks.get('pre_method')
+        self.pre_render = self.hooks.get('pre_render')
+        self.pre_response = self.hooks.get('pre_response')
+
+        # responders depend on the request, so they are compiled on first use
+        self.responders = {}
+
+        self.expected_qs_args = frozenset(view_cls.expected_qs_args)
+
+        self.loader_batches = self.compile_loaders()
+
+        # views with coroutine hooks, loaders or responders are dispatched asynchronously
+        self.is_async = any(
+            getattr(step, 'is_async', False) for step in self.hooks.values()
+        ) or any(
+            step.is_async for batch in self.loader_batches for arg_key, step in batch
+        ) or self.has_async_responders()
+
+    def compile_step(self, name):
+        attr = inspect.getattr_static(self.view_cls, name, None)
+        if attr is None:
+            return None
+        if inspect.isfunction(attr):
+            return ViewStep(attr)
+
+        def dynamic_step(view, calling_args):
+            return _call_with_expected_args(view, calling_args, name)
+        return dynamic_step
+
+    def compile_loaders(self):
+        """
+            Find the `*_loader` methods of the view class and group them into batches.  A loader
+            depends on another loader if it takes that loader's argument, or if it is declared
+            with `depends_on`.  Loaders in a batch only depend on loaders in earlier batches.
+        """
+        loaders = {}
+        dependencies = {}
+        for attr_name in dir(self.view_cls):
+            if not attr_name.endswith('_loader'):
+                continue
+            func = inspect.getattr_static(self.view_cls, attr_name)
+            if not inspect.isfunction(func):
+                continue
+            arg_key = attr_name[:-7]
+            loaders[arg_key] = ViewStep(func)
+            dependencies[arg_key] = set(inspect.signature(func).parameters)
+            dependencies[arg_key].update(getattr(func, '_keg_loader_depends', ()))
+
+        try:
+            batches = dependency_batches(dependencies)
+        except ValueError as e:
+            raise LoaderDependencyError(_('Loaders of {view} can not be ordered. {error}',
+                                          view=self.view_cls.__name__, error=e))
+        return [[(arg_key, loaders[arg_key]) for arg_key in batch] for batch in batches]
+
+    def has_async_responders(self):
+        for attr_name in dir(self.view_cls):
+            func = inspect.getattr_static(self.view_cls, attr_name)
+            if not inspect.iscoroutinefunction(func):
+                continue
+            if attr_name in http_method_funcs or hasattr(func, '_keg_rules'):
+                return True
+        return False
+
+    def call_responder(self, view, calling_args, method_obj):
+        func = getattr(method_obj, '__func__', None)
+        if getattr(method_obj, '__self__', None) is not view or not inspect.isfunction(func):
+            return _call_with_expected_args(view, calling_args, method_obj)
+
+        step = self.responders.get(func)
+        if step is None:
+            step = self.responders[func] = ViewStep(func)
+        return step(view, calling_args)
+
+
+_loader_executor = None
+_loader_executor_lock = threading.Lock()
+
+
+def loader_executor():
+    """
+        The thread pool shared by views that run their loaders concurrently.  It is created on
+        first use, sized by the ``KEG_LOADER_MAX_WORKERS`` config value.
+    """
+    global _loader_executor
+    with _loader_executor_lock:
+        if _loader_executor is None:
+            _loader_executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('KEG_LOADER_MAX_WORKERS'),
+                thread_name_prefix='keg-loader',
+            )
+        return _loader_executor
+
+
+def shutdown_loader_executor():
+    """ Shut down the loader thread pool.  A new one will be created when next needed. """
+    global _loader_executor
+    with _loader_executor_lock:
+        if _loader_executor is not None:
+            _loader_executor.shutdown(wait=False)
+            _loader_executor = None
+
+
 class _OldViewMeta(MethodViewType or object):
     def __init__(cls, name, bases, d):
         MethodViewType.__init__(cls, name, bases, d)
@@ -116,6 +291,8 @@ class BaseView(MethodView, metaclass=_ViewMeta):
     auto_assign = tuple()
     # names of qs arguments that should be merged w/ URL arguments and passed to view methods
     expected_qs_args = []
+    # run loaders that do not depend on each other at the same time (see call_loader_batch)
+    concurrent_loaders = False
 
     def __init_subclass__(cls, **kwargs):
         """Flask before 2.2.0 used a metaclass to perform view setup, but this
@@ -152,59 +329,163 @@ class BaseView(MethodView, metaclass=_ViewMeta):
 
         return method_obj
 
+    @classmethod
+    def dispatch_plan(cls):
+        """ The compiled `DispatchPlan` for this view class, compiled on first use if routes have
+            not been set up for the class. """
+        plan = cls.__dict__.get('_dispatch_plan')
+        if plan is None:
+            plan = cls.compile_dispatch_plan()
+        return plan
+
+    @classmethod
+    def compile_dispatch_plan(cls):
+        """ (Re)build the dispatch plan for this class.  Call this if hook methods are changed on
+            the class after its routes have been set up. """
+        cls._dispatch_plan = DispatchPlan(cls)
+        return cls._dispatch_plan
+
     def dispatch_request(self, **kwargs):
+        plan = self.dispatch_plan()
+        if plan.is_async:
+            return current_app.ensure_sync(self.async_dispatch_request)(**kwargs)
+
         self.template_args = {}
         calling_args = self.process_calling_args(kwargs)
         self._calling_args = calling_args
-        _call_with_expected_args(self, calling_args, 'pre_auth')
-        _call_with_expected_args(self, calling_args, 'check_auth')
-        _call_with_expected_args(self, calling_args, 'pre_loaders')
+        for step in plan.before_loaders:
+            step(self, calling_args)
         self.call_loaders(calling_args)
-        _call_with_expected_args(self, calling_args, 'pre_method')
+        if plan.pre_method is not None:
+            plan.pre_method(self, calling_args)
 
         method_obj = self.calc_responding_method()
-        response = _call_with_expected_args(self, calling_args, method_obj)
+        response = plan.call_responder(self, calling_args, method_obj)
 
         # The following condition is intended to guard against None or no return
         # from the responding method. But, an empty string is a valid response that
         # would fail the falsy test, so check that one specifically.
         if not response and response != '':
             self.process_auto_assign()
-            _call_with_expected_args(self, calling_args, 'pre_render')
+            if plan.pre_render is not None:
+                plan.pre_render(self, calling_args)
             response = self.render()
         calling_args['_response'] = response
-        pre_response = _call_with_expected_args(self, calling_args, 'pre_response')
-        if pre_response is not None:
-            return pre_response
+        if plan.pre_response is not None:
+            pre_response = plan.pre_response(self, calling_args)
+            if pre_response is not None:
+                return pre_response
+        return response
+
+    async def async_dispatch_request(self, **kwargs):
+        """
+            Same lifecycle as `dispatch_request`, awaiting any hook, loader or responding method
+            that is a coroutine function.  `dispatch_request` hands off to this method when the
+            view has such methods, which requires Flask's async support.
+        """
+        plan = self.dispatch_plan()
+        self.template_args = {}
+        calling_args = self.process_calling_args(kwargs)
+        self._calling_args = calling_args
+        for step in plan.before_loaders:
+            await _await_step(step, self, calling_args)
+        await self.async_call_loaders(calling_args)
+        if plan.pre_method is not None:
+            await _await_step(plan.pre_method, self, calling_args)
+
+        method_obj = self.calc_responding_method()
+        response = plan.call_responder(self, calling_args, method_obj)
+        if inspect.isawaitable(response):
+            response = await response
+
+        # See dispatch_request() for why an empty string is checked specifically.
+        if not response and response != '':
+            self.process_auto_assign()
+            if plan.pre_render is not None:
+                await _await_step(plan.pre_render, self, calling_args)
+            response = self.render()
+        calling_args['_response'] = response
+        if plan.pre_response is not None:
+            pre_response = await _await_step(plan.pre_response, self, calling_args)
+            if pre_response is not None:
+                return pre_response
         return response
 
     def process_calling_args(self, urlargs):
-        # start with query string arguments that are expected
-        args = MultiDict()
-        if self.expected_qs_args:
-            for k in request.args.keys():
-                if k in self.expected_qs_args:
-                    args.setlist(k, request.args.getlist(k))
+        # start with query string arguments that are expected, using a single value if only one
+        # value is given or a list if multiple values
+        args = {}
+        expected_qs_args = self.dispatch_plan().expected_qs_args
+        if expected_qs_args:
+            query_args = request.args
+            for k in expected_qs_args.intersection(query_args.keys()):
+                values = query_args.getlist(k)
+                args[k] = values[0] if len(values) == 1 else values
 
         # add URL arguments, replacing GET arguments if they are there.  URL
-        # arguments get precedence and we don't want to just .update()
-        # because that would allow arbitrary get arguments to affect the
+        # arguments get precedence, so arbitrary get arguments can't affect the
         # values of the URL arguments
-        for k, v in urlargs.items():
-            args[k] = v
+        args.update(urlargs)
 
-        return _werkzeug_multi_dict_conv(args)
+        return args
 
     def call_loaders(self, calling_args):
-        for attr_name, method_obj in inspect.getmembers(self, inspect.ismethod):
-            if not attr_name.endswith('_loader'):
+        for batch in self.dispatch_plan().loader_batches:
+            if self.concurrent_loaders and len(batch) > 1:
+                results = self.call_loader_batch(batch, calling_args)
+            else:
+                results = (step(self, calling_args) for arg_key, step in batch)
+
+            for (arg_key, step), retval in zip(batch, results):
+                self.store_loader_result(arg_key, retval)
+
+    async def async_call_loaders(self, calling_args):
+        for batch in self.dispatch_plan().loader_batches:
+            if self.concurrent_loaders and len(batch) > 1:
+                results = await self.async_call_loader_batch(batch, calling_args)
+                for (arg_key, step), retval in zip(batch, results):
+                    self.store_loader_result(arg_key, retval)
                 continue
-            arg_key = attr_name[:-7]
-            retval = _call_with_expected_args(self, calling_args, method_obj)
-            if retval is None:
-                flask.abort(404)
-            # have to add it to internal variable b/c calling_args is a copy, not the actual object
-            self._calling_args[arg_key] = retval
+
+            for arg_key, step in batch:
+                self.store_loader_result(arg_key, await _await_step(step, self, calling_args))
+
+    def store_loader_result(self, arg_key, retval):
+        if retval is None:
+            flask.abort(404)
+        # have to add it to internal variable b/c calling_args is a copy, not the actual object
+        self._calling_args[arg_key] = retval
+
+    def call_loader_batch(self, batch, calling_args):
+        """
+            Run a batch of independent loaders at the same time and return their results in
+            batch order.  They run on the `loader_executor` thread pool with the current request
+            and app contexts.  Views with coroutine loaders are dispatched asynchronously, see
+            `async_call_loader_batch`.
+
+            Sharing the app context means sharing its scoped db session, which is not
+            thread-safe: only one loader of a batch may use it.
+        """
+        futures = [
+            loader_executor().submit(contextvars.copy_context().run, step, self, calling_args)
+            for arg_key, step in batch
+        ]
+        wait_futures(futures)
+        return [future.result() for future in futures]
+
+    async def async_call_loader_batch(self, batch, calling_args):
+        """ Async counterpart of `call_loader_batch`. """
+        loop = asyncio.get_running_loop()
+        awaitables = []
+        for arg_key, step in batch:
+            if step.is_async:
+                awaitables.append(step(self, calling_args))
+            else:
+                run_in_context = contextvars.copy_context().run
+                awaitables.append(loop.run_in_executor(
+                    loader_executor(), run_in_context, step, self, calling_args
+                ))
+        return await asyncio.gather(*awaitables)
 
     def check_auth(self):
         pass
@@ -223,6 +504,11 @@ class BaseView(MethodView, metaclass=_ViewMeta):
     def calc_template_name(self, use_us=False):
         if self.template_name is not None:
             return self.template_name
+        if not use_us:
+            template = self.cached_template()
+            if template is not None:
+                return template.name
+
         template_path = '{}.html'.format(self.calc_class_fname(use_us=use_us))
         blueprint_name = request.blueprint
         if blueprint_name:
@@ -232,7 +518,7 @@ class BaseView(MethodView, metaclass=_ViewMeta):
         # template names generated with underscores.
         jinja_env = current_app.jinja_env
         try:
-            jinja_env.get_template(template_path)
+            template = jinja_env.get_template(template_path)
         except TemplateNotFound:
             raise_original_exception = False
             if not use_us:
@@ -240,6 +526,7 @@ class BaseView(MethodView, metaclass=_ViewMeta):
                 # that succeeds
                 try:
                     template_path = self.calc_template_name(use_us=True)
+                    template = jinja_env.get_template(template_path)
                     warn(
                         'Templates named by underscore-notated class names are '
                         'deprecated and will not be supported. Rename the template '
@@ -253,13 +540,41 @@ class BaseView(MethodView, metaclass=_ViewMeta):
             if use_us or raise_original_exception:
                 raise
 
+        if not use_us:
+            self.cache_template(template)
         return template_path
 
+    def cached_template(self):
+        """
+            The template last resolved for this view class and blueprint, if any.  When Jinja
+            auto-reloads templates, the cached template is only used while it is up to date.
+        """
+        cache = getattr(current_app, 'view_template_cache', None) or {}
+        template = cache.get((self.__class__, request.blueprint))
+        if template is None or (current_app.jinja_env.auto_reload and not template.is_up_to_date):
+            return None
+        return template
+
+    def cache_template(self, template):
+        # apps other than Keg's don't have a cache
+        cache = getattr(current_app, 'view_template_cache', None)
+        if cache is not None:
+            cache[(self.__class__, request.blueprint)] = template
+
+    def calc_template(self):
+        """ The template object to render, so the template is not looked up again by name. """
+        template_name = self.calc_template_name()
+        template = self.cached_template()
+        if template is None or template.name != template_name:
+            template = current_app.jinja_env.get_template(template_name)
+            self.cache_template(template)
+        return template
+
     def assign(self, key, value):
         self.template_args[key] = value
 
     def render(self):
-        return flask.render_template(self.calc_template_name(), **self.template_args)
+        return flask.render_template(self.calc_template(), **self.template_args)
 
     @classmethod
     def calc_url(cls, use_blueprint=True):
@@ -343,6 +658,7 @@ class BaseView(MethodView, metaclass=_ViewMeta):
 
         cls.init_routes()
         cls.init_blueprint(rules)
+        cls.compile_dispatch_plan()
 
 
 class MethodRoute(object):
@@ -420,6 +736,19 @@ def route(rule=None, get=True, post=False, post_only=False, methods=None, **opti
     return wrapper
 
 
+def depends_on(*arg_keys):
+    """
+        Declare that a `*_loader` method needs the values of other loaders, given by their
+        argument names.  Loaders that take another loader's argument depend on it without needing
+        this decorator.
+    """
+    def wrapper(func):
+        func._keg_loader_depends = getattr(func, '_keg_loader_depends', ()) + arg_keys
+        return func
+
+    return wrapper
+
+
 def rule(rule=None, get=True, post=False, post_only=False, methods=None, **options):
     parent_locals = sys._getframe(1).f_locals
     rules = parent_locals.setdefault('_rules', [])
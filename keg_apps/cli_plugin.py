@@ -0,0 +1,7 @@
+import click
+
+
+# registered as an entry point in the plugin command tests
+@click.command('plugin-hello', short_help='Say hello from a plugin.')
+def hello_command():
+    click.echo('hello from plugin')
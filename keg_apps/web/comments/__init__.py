@@ -0,0 +1,4 @@
+from keg import KegViewComponent
+
+# registered after the components it requires, whatever the order of KEG_REGISTERED_COMPONENTS
+__component__ = KegViewComponent('comments', requires=('keg_apps.web.blog', 'keg_apps.web.news'))
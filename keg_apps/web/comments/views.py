@@ -0,0 +1,8 @@
+from . import __component__
+
+component_bp = __component__.create_named_blueprint(__name__)
+
+
+@component_bp.route('/comments')
+def comments():
+    return 'comments'
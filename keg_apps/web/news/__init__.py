@@ -0,0 +1,3 @@
+from keg import KegViewComponent
+
+__component__ = KegViewComponent('news')
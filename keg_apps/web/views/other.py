@@ -1,8 +1,11 @@
 from __future__ import absolute_import
 
+import asyncio
+import threading
+
 import flask
 
-from keg.web import BaseView as KegBaseView
+from keg.web import BaseView as KegBaseView, depends_on, rule
 
 blueprint = flask.Blueprint('other', __name__)
 
@@ -47,3 +50,120 @@ class ResponseMiddleware(BaseView):
 
     def get(self, name):
         return name
+
+
+class DispatchHooks(BaseView):
+    url = '/dispatch-hooks/<string:name>'
+
+    def pre_auth(self, name):
+        self.calls = ['pre_auth:{}'.format(name)]
+
+    def pre_loaders(self):
+        self.calls.append('pre_loaders')
+
+    def pre_method(self, name):
+        self.calls.append('pre_method:{}'.format(name))
+
+    def get(self):
+        return ','.join(self.calls + ['get'])
+
+
+class Loaders(BaseView):
+    url = '/loaders/<int:ident>'
+
+    @depends_on('owner')
+    def audit_loader(self):
+        return 'audited {}'.format(self._calling_args['owner'])
+
+    def owner_loader(self, record):
+        return 'owner{}'.format(record['ident'])
+
+    def record_loader(self, ident):
+        if ident:
+            return {'ident': ident}
+
+    def get(self, record, owner, audit):
+        return '{} {} {}'.format(record['ident'], owner, audit)
+
+
+class ConcurrentLoaders(BaseView):
+    url = '/concurrent-loaders/<string:name>'
+    concurrent_loaders = True
+    # Both loaders have to wait here, so the request only completes if they run at the same time.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def path_loader(self):
+        self.barrier.wait()
+        return flask.request.path
+
+    def shout_loader(self, name):
+        self.barrier.wait()
+        return name.upper()
+
+    async def greeting_loader(self, name):
+        await asyncio.sleep(0)
+        return 'hello {}'.format(name)
+
+    def get(self, path, shout, greeting):
+        return '{} {} {}'.format(path, shout, greeting)
+
+
+class ConcurrentSyncLoaders(BaseView):
+    url = '/concurrent-sync-loaders/<string:name>'
+    concurrent_loaders = True
+    barrier = threading.Barrier(2, timeout=5)
+
+    def path_loader(self):
+        self.barrier.wait()
+        return flask.request.path
+
+    def shout_loader(self, name):
+        self.barrier.wait()
+        if name == 'error':
+            raise ValueError('deliberate loader error')
+        return name.upper()
+
+    def get(self, path, shout):
+        return '{} {}'.format(path, shout)
+
+
+class AsyncLoader(BaseView):
+    url = '/async-loader/<string:name>'
+
+    async def greeting_loader(self, name):
+        await asyncio.sleep(0)
+        if name != 'missing':
+            return 'hello {}'.format(name)
+
+    def get(self, greeting):
+        return greeting
+
+
+class AsyncView(BaseView):
+    url = '/async-view/<string:name>'
+    template_name = 'other/auto-assign.html'
+    auto_assign = ('bar',)
+
+    async def pre_method(self, name):
+        await asyncio.sleep(0)
+        self.greeting = 'hello {}'.format(name)
+
+    async def get(self, name):
+        await asyncio.sleep(0)
+        if name == 'render':
+            self.bar = self.greeting
+            return
+        return self.greeting
+
+    async def pre_response(self, _response):
+        if _response == 'hello swap':
+            return 'swapped'
+
+
+class QueryArgs(BaseView):
+    expected_qs_args = ['color', 'size']
+    rule()
+    rule('<color>')
+
+    def get(self, color=None, size=None):
+        return '{} {}'.format(color, size)
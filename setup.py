@@ -46,6 +46,7 @@ setup(
     ],
     extras_require={
         'tests': [
+            'asgiref',
             'flask-webtest',
             'flask-wtf',
             'sqlalchemy_pyodbc_mssql',